@@ -0,0 +1,61 @@
+"""Measure the rows per second inserted into and read from an sqlite db
+on disk, with sqlalchemy's defaults and with the tuned profile:
+
+- insert_stuff, one transaction per row
+- insert_many, one transaction per batch
+- get_stuff_by_url, one session per read
+
+    python benchmarks/bench_db.py [count]
+"""
+from datetime import datetime, timedelta
+import os
+import sys
+import tempfile
+import time
+
+from stuff.core import Coordinates, Stuff
+from stuff.db import DBClient
+
+
+PROFILES = ["", "?profile=fast"]
+
+
+def listings(count, prefix):
+    start = datetime(2019, 9, 13)
+    return [
+        Stuff(
+            url="https://newyork.craigslist.org/brk/zip/d/{}-{}.html".format(prefix, i),
+            title="listing {}".format(i), time=start + timedelta(minutes=i), price=i % 100,
+            neighborhood="Bay Ridge", city="newyork", coordinates=Coordinates(-73.9, 40.6),
+            image_urls=["https://images.craigslist.org/{}.jpg".format(i)],
+        )
+        for i in range(count)
+    ]
+
+
+def rate(count, run):
+    start = time.perf_counter()
+    run()
+    return count / (time.perf_counter() - start)
+
+
+def bench(profile, count):
+    with tempfile.TemporaryDirectory() as directory:
+        client = DBClient.new("sqlite:///" + os.path.join(directory, "stuff.db") + profile)
+        client.create_db()
+        one_by_one = listings(count, "single")
+        batch = listings(count, "batch")
+        reads = [stuff.url for stuff in batch[::max(1, count // 2000)]]
+        return [
+            rate(count, lambda: [client.insert_stuff(stuff) for stuff in one_by_one]),
+            rate(count, lambda: client.insert_many(batch)),
+            rate(len(reads), lambda: [client.get_stuff_by_url(url) for url in reads]),
+        ]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print("{} rows, rows/s".format(count))
+    print("{:<16} {:>14} {:>14} {:>18}".format("profile", "insert_stuff", "insert_many", "get_stuff_by_url"))
+    for profile in PROFILES:
+        print("{:<16} {:>14.0f} {:>14.0f} {:>18.0f}".format(profile or "default", *bench(profile, count)))
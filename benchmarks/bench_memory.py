@@ -0,0 +1,77 @@
+"""Measure the memory held by a million listings, as plain attrs classes
+(how `Stuff` and `Coordinates` used to be) and as they are now.
+
+    python benchmarks/bench_memory.py [count]
+"""
+from datetime import datetime, timedelta
+from typing import List
+import gc
+import sys
+import tracemalloc
+
+import attr
+
+from stuff.core import Coordinates, Stuff
+
+NEIGHBORHOODS = ["Bay Ridge", "Clinton Hill", "Greenpoint", "Bushwick", "Park Slope", None]
+
+
+@attr.s
+class DictCoordinates:
+    longitude: int = attr.ib()
+    latitude: int = attr.ib()
+
+
+@attr.s
+class DictStuff:
+    url: str = attr.ib()
+    title: str = attr.ib()
+    time: datetime = attr.ib()
+    price: int = attr.ib()
+    neighborhood: str = attr.ib()
+    city: str = attr.ib()
+    image_urls: List[str] = attr.ib(default=None)
+    coordinates: DictCoordinates = attr.ib(default=None)
+    delivered: bool = attr.ib(default=False)
+    id: int = attr.ib(default=None)
+
+
+def _copy(value):
+    """a fresh copy of the string, as each parsed page (or db row) makes"""
+    return "".join(list(value)) if value is not None else None
+
+
+def listings(stuff_cls, coordinates_cls, count):
+    start = datetime(2019, 9, 13)
+    for i in range(count):
+        located = i % 4 == 0
+        yield stuff_cls(
+            url="https://newyork.craigslist.org/brk/zip/d/{}.html".format(i),
+            title="listing {}".format(i),
+            time=start + timedelta(minutes=i),
+            price=i % 100,
+            neighborhood=_copy(NEIGHBORHOODS[i % len(NEIGHBORHOODS)]),
+            city=_copy("newyork"),
+            image_urls=[],
+            coordinates=coordinates_cls("-73.9", "40.6") if located else coordinates_cls(None, None),
+            id=i,
+        )
+
+
+def bytes_per_listing(stuff_cls, coordinates_cls, count):
+    gc.collect()
+    tracemalloc.start()
+    held = list(listings(stuff_cls, coordinates_cls, count))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size / count
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    before = bytes_per_listing(DictStuff, DictCoordinates, count)
+    after = bytes_per_listing(Stuff, Coordinates.of, count)
+    print("{} listings".format(count))
+    print("{:<8} {:>10.0f} bytes/listing".format("before", before))
+    print("{:<8} {:>10.0f} bytes/listing ({:.0%})".format("after", after, after / before))
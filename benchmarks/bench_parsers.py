@@ -0,0 +1,53 @@
+"""Compare the throughput of the installed parser backends,
+of the tree-less `DetailsScanner` on item pages,
+and of parsing results pages in this process or on a process pool.
+
+    python benchmarks/bench_parsers.py
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+import timeit
+
+from stuff.parsers import PARSERS, get_parser, parse_rows, scan_details
+from stuff.tests.utils import _raw_data
+
+
+def bench(parser, content, parse, number):
+    seconds = min(timeit.repeat(lambda: parse(parser, content), number=number, repeat=3))
+    return number / seconds
+
+
+def bench_processes(content, pages, processes):
+    parser = get_parser()
+    start = time.perf_counter()
+    if processes:
+        with ProcessPoolExecutor(processes) as pool:
+            list(pool.map(parse_rows, [content] * pages, [parser.name] * pages))
+    else:
+        for _ in range(pages):
+            parser.rows(content)
+    return pages / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    results_page = _raw_data("craigslist_zip.html")
+    item_page = _raw_data("craigslist_zip_item_page.html")
+    print("{:<12} {:>16} {:>16}".format("parser", "results pages/s", "item pages/s"))
+    for name in PARSERS:
+        try:
+            parser = get_parser(name)
+        except ImportError:
+            print("{:<12} {:>16}".format(name, "not installed"))
+            continue
+        pages = bench(parser, results_page, lambda p, c: p.rows(c), number=5)
+        items = bench(parser, item_page, lambda p, c: p.parse_details(c), number=50)
+        print("{:<12} {:>16.1f} {:>16.1f}".format(name, pages, items))
+    items = bench(None, item_page, lambda p, c: scan_details(c), number=50)
+    print("{:<12} {:>16} {:>16.1f}".format("scanner", "-", items))
+
+    print()
+    print("{:<12} {:>16}".format("processes", "results pages/s"))
+    for processes in sorted({0, 2, os.cpu_count() or 1}):
+        pages = bench_processes(results_page, 200, processes)
+        print("{:<12} {:>16.1f}".format(processes or "inline", pages))
@@ -0,0 +1,53 @@
+"""Compare the size and speed of `stuff.snapshot` with JSON,
+on the listings of a results page repeated into a large batch.
+
+    python benchmarks/bench_snapshot.py [count]
+"""
+from datetime import datetime
+import json
+import sys
+import timeit
+
+from stuff import snapshot
+from stuff.core import Coordinates, Stuff
+from stuff.search import Search
+from stuff.tests.utils import _raw_data
+
+
+def to_json(stuff):
+    return json.dumps([
+        dict(item.to_api_dict(), time=item.time.isoformat()) for item in stuff
+    ]).encode()
+
+
+def from_json(data):
+    return [
+        Stuff.from_api_dict(dict(d, time=datetime.fromisoformat(d["time"]))) for d in json.loads(data)
+    ]
+
+
+def bench(encode, decode, stuff, number=3):
+    data = encode(stuff)
+    dump = min(timeit.repeat(lambda: encode(stuff), number=1, repeat=number))
+    load = min(timeit.repeat(lambda: decode(data), number=1, repeat=number))
+    return len(data), dump, load
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    page = Search().parse_inventory(_raw_data("craigslist_zip.html"))
+    stuff = []
+    for i in range(count):
+        item = page[i % len(page)]
+        stuff.append(Stuff(
+            url=item.url.replace(".html", "-{}.html".format(i)), title=item.title, time=item.time,
+            price=item.price, neighborhood=item.neighborhood, city=item.city, id=i,
+            image_urls=["https://images.craigslist.org/{}_600x450.jpg".format(i)],
+            coordinates=Coordinates(-73.957, 40.6467),
+        ))
+
+    print("{} listings".format(count))
+    print("{:<10} {:>12} {:>12} {:>12}".format("format", "bytes", "dumps (s)", "loads (s)"))
+    for name, encode, decode in [("json", to_json, from_json), ("snapshot", snapshot.dumps, snapshot.loads)]:
+        size, dump, load = bench(encode, decode, stuff)
+        print("{:<10} {:>12} {:>12.3f} {:>12.3f}".format(name, size, dump, load))
@@ -7,6 +7,8 @@ from stuff.search import Search, Proximinity
 from stuff.emitters import EmitSms
 from stuff.emitters import EmitTweet
 from stuff.client import StatefulClient
+from stuff.cache import DetailsCache
+from stuff.proxies import ProxyPool
 
 
 welcome_message = """
@@ -35,18 +37,23 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", default=".secrets")
     parser.add_argument("--region", default="new_york_city")
-    parser.add_argument("--area", default="brooklyn")
-    parser.add_argument("--category", default="furniture")
-    parser.add_argument("--query", default="")
+    # area, category and query take several values, every combination is watched
+    parser.add_argument("--area", nargs="+", default=["brooklyn"])
+    parser.add_argument("--category", nargs="+", default=["furniture"])
+    parser.add_argument("--query", nargs="+", default=[""])
     parser.add_argument("--zip", default="")
     parser.add_argument("--distance", type=int, default=2)
-    parser.add_argument("--db_path", default="sqlite:///stuff.db")
+    # ?profile=fast tunes sqlite (wal, pragmas and pooled connections), see stuff.db.SQLITE_PROFILES
+    parser.add_argument("--db_path", default="sqlite:///stuff.db?profile=fast")
     parser.add_argument("--sms", default="")  # this is treated as bool
+    parser.add_argument("--proxy", nargs="*", default=[])  # requests are rotated across these
+    parser.add_argument("--details_cache", default="details.db")  # empty to not cache
+    parser.add_argument("--parse_processes", type=int, default=0)  # 0 parses in the main process
     args = parser.parse_args()
     print(
         welcome_message.format(
-            args.region, args.area, args.category,
-            args.query, args.distance if args.zip else "", args.zip,
+            args.region, " ".join(args.area), " ".join(args.category),
+            " ".join(args.query), args.distance if args.zip else "", args.zip,
             args.db_path, "sms" if args.sms else "twitter",
         )
     )
@@ -72,17 +79,25 @@ if __name__ == "__main__":
             access_token_secret=config["twitter"]["access_token_secret"],
         )
     client = StatefulClient.new(
-        search=Search(
-            region=Region[args.region],
-            area=Area[args.area],
-            category=Category[args.category],
-            query=args.query,
-            proximinity=Proximinity(args.distance, args.zip) if args.zip else None,
-        ),
+        searches=[
+            Search(
+                region=Region[args.region],
+                area=Area[area],
+                category=Category[category],
+                query=query,
+                proximinity=Proximinity(args.distance, args.zip) if args.zip else None,
+            )
+            for area in args.area
+            for category in args.category
+            for query in args.query
+        ],
         db_path=args.db_path,
         emitter=emitter,
         sleep_seconds=sleep_time,
         log_level=log_level,
+        proxy_pool=ProxyPool.new(args.proxy) if args.proxy else None,
+        details_cache=DetailsCache.new(args.details_cache) if args.details_cache else None,
+        parse_processes=args.parse_processes or None,
     )
 
     client.setup()
@@ -27,6 +27,8 @@ setuptools.setup(
         'twitter': ["python-twitter"],
         'client': ["sqlalchemy", "python-twitter", "twilio"],
         'map': ["folium", "geopy"],
+        'fast': ["lxml", "selectolax"],
+        'columnar': ["numpy"],
     },
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -0,0 +1,97 @@
+from typing import Callable, Optional
+import json
+import sqlite3
+import threading
+import time
+
+import attr
+
+from stuff.parsers import ItemDetails
+
+
+DAY = 24 * 60 * 60
+
+
+@attr.s
+class DetailsCache:
+    """
+    DetailsCache keeps the details (image urls and coordinates) extracted
+    from item pages on disk, keyed by the item's url, so that enriching an
+    item again, e.g. after a restart, costs a disk read instead of a request.
+
+    Entries expire `ttl` seconds after they're stored, and once there are
+    more than `max_entries` the least recently used are evicted.
+
+    examples:
+
+    cache = DetailsCache.new("details.db")
+    cache.put(url, details)
+    cache.get(url)  # None if missing or expired
+    """
+    connection: sqlite3.Connection = attr.ib(repr=False)
+    ttl: float = attr.ib(default=7 * DAY)
+    max_entries: int = attr.ib(default=100000)
+    clock: Callable[[], float] = attr.ib(default=time.time, repr=False)
+    entries: int = attr.ib(default=0)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False)
+
+    @classmethod
+    def new(cls, path=":memory:", **kwargs):
+        connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS details ("
+            " url TEXT PRIMARY KEY, details TEXT NOT NULL,"
+            " stored REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS details_accessed ON details (accessed)")
+        entries = connection.execute("SELECT count(*) FROM details").fetchone()[0]
+        return cls(connection, entries=entries, **kwargs)
+
+    def get(self, url: str) -> Optional[ItemDetails]:
+        now = self.clock()
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT details, stored FROM details WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM details WHERE url = ?", (url,))
+                self.entries -= 1
+                return None
+            self.connection.execute("UPDATE details SET accessed = ? WHERE url = ?", (now, url))
+        image_urls, longitude, latitude = json.loads(row[0])
+        return ItemDetails(image_urls, longitude, latitude)
+
+    def put(self, url: str, details: ItemDetails):
+        now = self.clock()
+        payload = json.dumps(list(details))
+        with self._lock:
+            updated = self.connection.execute(
+                "UPDATE details SET details = ?, stored = ?, accessed = ? WHERE url = ?",
+                (payload, now, now, url),
+            ).rowcount
+            if updated:
+                return
+            self.connection.execute(
+                "INSERT INTO details (url, details, stored, accessed) VALUES (?, ?, ?, ?)",
+                (url, payload, now, now),
+            )
+            self.entries += 1
+            if self.entries > self.max_entries:
+                self._evict(self.entries - self.max_entries)
+
+    def _evict(self, count: int):
+        self.connection.execute(
+            "DELETE FROM details WHERE url IN"
+            " (SELECT url FROM details ORDER BY accessed LIMIT ?)", (count,)
+        )
+        self.entries -= count
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def close(self):
+        self.connection.close()
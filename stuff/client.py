@@ -1,11 +1,17 @@
-from typing import Optional
+from typing import Dict, List, Optional, Set
 import time
 import attr
 import logging
 from logging import Logger
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.pool import ThreadPool
+
+import requests
 
 from stuff.core import Stuff
+from stuff.parsers import parse_rows
 from stuff.constants import Area, Region, Category
+from stuff.reposts import RepostIndex
 from stuff.search import Search, Proximinity
 from stuff.db import DBClient
 from stuff.emitters import Emitter, EmitStdout
@@ -15,9 +21,16 @@ from stuff.emitters import Emitter, EmitStdout
 class StatefulClient:
     """
     The StatefulClient is the main entrypoint for the `stuff` package.
-    It ties together the necessary search and DB client
+    It ties together the necessary searches and DB client
     with an arbitrary `stuff.emitters.Emitter`.
 
+    Reposts of recent listings (see `stuff.reposts`) are stored
+    but neither enriched nor emitted.
+
+    Any number of searches can be watched by one client: their results
+    pages are fetched concurrently and listings appearing in more than
+    one of them are only stored and emitted once.
+
     examples:
 
     client = StatefulClient.new()  # default Stdout emitter
@@ -28,28 +41,60 @@ class StatefulClient:
         client.log.info("Interrupted the loop with keyboard")
         sys.exit(0)
 
+    multiple searches example:
+
+    client = StatefulClient.new(searches=[
+        Search(area=area, category=category, query=query)
+        for area in [Area.brooklyn, Area.queens]
+        for category in [Category.free, Category.furniture]
+        for query in ["rug", "desk"]
+    ])
+
     proxy example:
 
       proxies = {"http": "http://1.1.1.1:3129"}
+      proxy_pool = ProxyPool.new(["http://1.1.1.1:3129", "http://2.2.2.2:3129"])
     """
 
     db_client: DBClient = attr.ib()
-    search: Search = attr.ib()
+    searches: List[Search] = attr.ib()
     emitter: Emitter = attr.ib()
     sleep_seconds: int = attr.ib()
     logger: Logger = attr.ib()
     proxies: Optional[dict] = attr.ib()
+    fetch_threads: int = attr.ib(default=8)
+    enrichment_deadline: Optional[float] = attr.ib(default=60.0)
+    hedge_after: Optional[float] = attr.ib(default=5.0)
+    reposts: Optional[RepostIndex] = attr.ib(factory=RepostIndex)
+    seen_urls: Optional[Set[str]] = attr.ib(default=None, repr=False)
 
     @classmethod
     def new(
-            cls, db_path="sqlite://", search=Search(),
+            cls, db_path="sqlite://", search=None,
             emitter=EmitStdout(), sleep_seconds=3000,
-            log_level="INFO", proxies=None,
+            log_level="INFO", proxies=None, searches=None,
+            fetch_threads=8, proxy_pool=None, details_cache=None,
+            enrichment_deadline=60.0, hedge_after=5.0, parse_processes=None,
     ):
         """
         default sqlite db is in-memory
         default emitter is stdout
         default sleep time is 3,000 seconds
+        default search is a new `Search()`
+
+        when given `searches` (rather than a single `search`) they're
+        made to share the first search's connection pool.
+
+        `proxies` sends every request through the same proxies,
+        a `stuff.proxies.ProxyPool` rotates them across its proxies.
+
+        a `stuff.cache.DetailsCache` keeps the enriched details on disk.
+
+        enrichment gives up after `enrichment_deadline` seconds per cycle,
+        and hedges item pages still loading after `hedge_after` seconds.
+
+        `parse_processes` parses pages on a pool of that many processes,
+        which pays off when watching many searches on a multi-core machine.
         """
         logger = logging.getLogger("stufflib")
         logging.basicConfig(
@@ -58,14 +103,77 @@ class StatefulClient:
             datefmt='%m/%d/%y %H:%M:%S',
         )
 
+        searches = list(searches) if searches else [search or Search()]
+        for other in searches[1:]:
+            other.session = searches[0].session
+        if details_cache is not None:
+            for each in searches:
+                each.cache = details_cache
+        if proxy_pool:
+            searches[0].session.proxy_pool = proxy_pool
+        if parse_processes:
+            processes = ProcessPoolExecutor(parse_processes)
+            for each in searches:
+                each.processes = processes
+
         db = DBClient.new(db_path)
-        return cls(db, search, emitter, sleep_seconds, logger, proxies)
+        return cls(
+            db, searches, emitter, sleep_seconds, logger, proxies, fetch_threads,
+            enrichment_deadline, hedge_after,
+        )
 
     def query(self, region: Region, area: Area, category: Category, keyword: str, proximinity: Proximinity):
-        self.search = Search(
-            region=region, area=area, category=category,
-            query=keyword, proximinity=proximinity,
-        )
+        """query replaces the searches, keeping their connection pool, cache and parse processes"""
+        current = self.searches[0]
+        self.searches = [
+            Search(
+                region=region, area=area, category=category,
+                query=keyword, proximinity=proximinity, session=current.session,
+                cache=current.cache, processes=current.processes,
+            )
+        ]
+
+    def poll_inventory(self, known_run=3) -> Optional[List[Stuff]]:
+        """
+        poll_inventory fetches the results pages of every search concurrently
+        and returns the listings not yet in the db, without duplicates,
+        or None when none of the pages changed.
+        """
+        threads = max(1, min(len(self.searches), self.fetch_threads))
+        with ThreadPool(threads) as p:
+            pages = p.map(self._get_changed_content, self.searches)
+        if all(content is None for content in pages):
+            return None
+
+        # with process pools, every changed page is parsed at once
+        parsing = [
+            search.processes.submit(parse_rows, content, search.parser.name)
+            if search.processes is not None and content is not None else None
+            for search, content in zip(self.searches, pages)
+        ]
+
+        # the db is only queried from this thread (in memory sqlite is per thread)
+        inventory, urls = [], set()
+        for search, content, rows in zip(self.searches, pages, parsing):
+            if content is None:
+                continue
+            if rows is not None:
+                items = search.inventory_from_rows(rows.result(), known_run=known_run, known_urls=self.known_urls)
+            else:
+                items = search.parse_inventory(content, known_run=known_run, known_urls=self.known_urls)
+            for item in items:
+                if item.url not in urls:
+                    urls.add(item.url)
+                    inventory.append(item)
+        return inventory
+
+    def _get_changed_content(self, search: Search) -> Optional[bytes]:
+        """a search failing to fetch its page has no page this cycle, the others carry on"""
+        try:
+            return search.get_changed_content()
+        except requests.RequestException as e:
+            self.logger.warning(f"Failed fetching {search.build_url()}: {e}")
+            return None
 
     def setup(self):
         self.db_client.create_db()
@@ -73,66 +181,182 @@ class StatefulClient:
     def refresh(self):
         self.db_client.drop_db()
         self.db_client.create_db()
+        if self.seen_urls is not None:
+            self.seen_urls = set()
 
-    def select_stuff(self, location, limit):
-        return self.db_client.get_some_stuff(location, limit)
+    def known_urls(self, urls: List[str]) -> Set[str]:
+        """
+        known_urls returns which of the urls are stored, from `seen_urls`
+        once it's warmed, else with a query.
+        """
+        if self.seen_urls is None:
+            return self.db_client.existing_urls(urls)
+        return {url for url in urls if url in self.seen_urls}
 
-    def populate_db(self, set_delivered=False, enrich_inventory=False, limit_enrichment=0):
+    def warm_seen(self):
+        """
+        warm_seen loads the urls of all the stored stuff into `seen_urls`,
+        after which telling new listings apart costs no queries.
+        It assumes this client is the only one adding stuff to the db.
+        """
+        self.seen_urls = self.db_client.get_urls()
+
+    def select_stuff(self, location, limit, offset=0):
+        return self.db_client.get_some_stuff(location, limit, offset)
+
+    def populate_db(self, set_delivered=False, enrich_inventory=False, limit_enrichment=0, known_run=3):
         """
         populate_db will set all the stuff objects to delivered
         so that when the loop begins, there is no "catch up"
         or waterfall of emissions.
 
         the flag for enriching_inventory should be used if emitting
-        using a media-ready emission API (not stdout or sms) like twitter
+        using a media-ready emission API (not stdout or sms) like twitter,
+        new stuff is stored first and then enriched from the backlog,
+        at most `limit_enrichment` items per cycle (0 for no limit).
+
+        the results page is only parsed until `known_run` listings in a row
+        are already in the db (set it to None to parse the whole page).
         """
-        inventory = self.search.get_inventory()
-        # check if things not in db exits
-        new_items = [
-            item for item in inventory
-            if not self.db_client.get_stuff_by_url(item.url)
-        ]
-        if enrich_inventory and new_items:
-            self.logger.info(f"Enriching {len(new_items)} items")
-            if limit_enrichment:
-                new_items = Search.enrich_inventory(
-                    new_items[:limit_enrichment], self.proxies
-                ) + new_items[limit_enrichment:]
+        # only parse things not in db
+        new_items = self.poll_inventory(known_run=known_run)
+        if new_items is None:
+            self.logger.debug("Search results unchanged, skipping")
+        else:
+            self.logger.info("Inserting {} item".format(len(new_items)))
+            reposts = self.find_reposts(new_items)
+            for item in new_items:
+                item.delivered = set_delivered
+                if item.url in reposts:
+                    # stored so it's known, but neither enriched nor emitted
+                    self.logger.info(f"Skipping {item.title}, a repost of {reposts[item.url]}")
+                    item.delivered, item.image_urls = True, []
+            # stuff another client sharing the db stored meanwhile is skipped
+            urls = [item.url for item in new_items]
+            new_items = self.db_client.upsert_many(new_items)
+            if len(new_items) < len(urls):
+                self.logger.info(f"{len(urls) - len(new_items)} items were already stored")
+            if self.seen_urls is not None:
+                self.seen_urls.update(urls)
+        for search in self.searches:
+            search.confirm_pages()
+
+        if enrich_inventory:
+            self.enrich_backlog(budget=limit_enrichment)
+
+    def find_reposts(self, new_items: List[Stuff]) -> Dict[str, str]:
+        """
+        find_reposts returns the urls of the new items which are near duplicates
+        of recent listings (or of older new items) and the urls they repost.
+        """
+        reposts: Dict[str, str] = {}
+        if self.reposts is None:
+            return reposts
+        for item in reversed(new_items):  # oldest first, the original is the older one
+            original = self.reposts.check(item)
+            if original is None:
+                self.reposts.add(item)
             else:
-                new_items = Search.enrich_inventory(new_items, self.proxies)
+                reposts[item.url] = original
+        return reposts
+
+    def warm_reposts(self):
+        """warm_reposts indexes the most recent stored listings, e.g. on startup"""
+        if self.reposts is None:
+            return
+        for item in reversed(self.db_client.get_all_stuff(limit=self.reposts.max_entries)):
+            self.reposts.add(item)
 
-        self.logger.info("Inserting {} item".format(len(new_items)))
-        for item in new_items:
-            item.delivered = set_delivered
-            self.db_client.insert_stuff(item)
+    def enrich(self, stuff: List[Stuff]) -> List[Stuff]:
+        return self.searches[0].enrich_inventory(
+            stuff, self.proxies, deadline=self.enrichment_deadline, hedge_after=self.hedge_after,
+        )
+
+    def enrich_backlog(self, budget: Optional[int] = None) -> int:
+        """
+        enrich_backlog enriches up to `budget` stored items which haven't
+        been yet, newest first, and writes back their details together.
+        The items left over, or which missed the enrichment deadline,
+        stay on the backlog for the next cycle.
+        """
+        pending = self.db_client.get_unenriched_stuff(limit=budget or None)
+        if not pending:
+            return 0
+        self.logger.info(f"Enriching {len(pending)} items")
+        enriched = [item for item in self.enrich(pending) if item.image_urls is not None]
+        if enriched:
+            self.db_client.update_details(enriched)
+        if len(enriched) < len(pending):
+            self.logger.info(f"{len(pending) - len(enriched)} items missed enrichment, retrying next cycle")
+        return len(enriched)
 
     def deliver(self, stuff: Stuff) -> str:
+        result = self.emit(stuff)
+        if stuff.delivered and stuff.id is not None:
+            self.db_client.mark_delivered([stuff.id])
+        return result
+
+    def emit(self, stuff: Stuff) -> str:
+        """emit sends the stuff to the emitter and, if it went through, sets it delivered"""
         # TODO: consider... should this exception be caught here?
         try:
             result = self.emitter.emit(stuff)
             stuff.delivered = True
-            self.db_client.update_stuff(stuff)
             self.logger.info(self.emitter.log(result))
         except Exception as e:
             result = "Failure Delivering {}".format(e)
             self.logger.error(result)
         return result
 
+    def enrich_for_delivery(self, stuff: List[Stuff]) -> List[Stuff]:
+        """
+        enrich_for_delivery enriches the stuff about to be delivered which
+        hasn't been yet, and stores the details so it's only done once.
+        Items missing the enrichment deadline are delivered as they are.
+        """
+        pending = [item for item in stuff if item.image_urls is None]
+        if pending:
+            self.logger.info(f"Enriching {len(pending)} items before delivery")
+            enriched = [item for item in self.enrich(pending) if item.image_urls is not None]
+            if enriched:
+                self.db_client.update_details(enriched)
+        return stuff
+
+    def deliver_undelivered(self, with_media=False) -> List[str]:
+        all_stuff = self.db_client.get_all_undelivered_stuff()
+        if not all_stuff:
+            self.logger.debug("Nothing to emit")
+            return []
+        if with_media:
+            all_stuff = self.enrich_for_delivery(all_stuff)
+        self.logger.info(f"Emitting {len(all_stuff)} stuff")
+        results = []
+        try:
+            for stuff in all_stuff:  # TODO: reverse list?
+                self.logger.info(f"Emitting: {stuff.title}")
+                results.append(self.emit(stuff))
+        finally:
+            self.db_client.mark_delivered([
+                stuff.id for stuff in all_stuff if stuff.delivered and stuff.id is not None
+            ])
+        return results
+
     def loop(self, with_media=False):
+        """
+        loop polls the searches and delivers the new stuff every `sleep_seconds`.
+
+        with_media, stuff is enriched right before it's delivered,
+        never on ingest, so the stuff marked delivered on startup
+        (and any never delivered) costs no item page requests.
+        """
+        self.warm_seen()
+        self.warm_reposts()
         self.logger.info("Initial Populating of Database with all stuff marked delivered")
-        self.populate_db(set_delivered=True, enrich_inventory=with_media)
+        self.populate_db(set_delivered=True)
         self.logger.info("Starting Loop")
         while True:
-            self.populate_db(enrich_inventory=with_media)
-
-            all_stuff = self.db_client.get_all_undelivered_stuff()
-            if len(all_stuff) > 0:
-                self.logger.info(f"Emitting {len(all_stuff)} stuff")
-                for stuff in all_stuff:  # TODO: reverse list?
-                    self.logger.info(f"Emitting: {stuff.title}")
-                    self.deliver(stuff)
-            else:
-                self.logger.debug("Nothing to emit")
+            self.populate_db()
+            self.deliver_undelivered(with_media=with_media)
 
             self.logger.debug("Sleeping {} seconds".format(self.sleep_seconds))
             time.sleep(self.sleep_seconds)
@@ -1,85 +1,127 @@
-from typing import List
+from typing import Any, List, Optional, Union
+import sys
 from bs4.element import Tag
 
 import attr
 from datetime import datetime
 
+from stuff.parsers import ItemDetails, ListingRow, soup_details, soup_row
 
-@attr.s
+
+@attr.s(slots=True, frozen=True)
 class Coordinates:
-    longitude: int = attr.ib()
-    latitude: int = attr.ib()
+    # strings as scraped from item pages, floats as read from the db, None when unknown
+    longitude: Optional[Union[float, str]] = attr.ib()
+    latitude: Optional[Union[float, str]] = attr.ib()
+
+    @classmethod
+    def of(cls, longitude, latitude) -> "Coordinates":
+        """of returns the coordinates, sharing one instance for the unknown ones"""
+        if longitude is None and latitude is None:
+            return NO_COORDINATES
+        return cls(longitude, latitude)
+
+
+NO_COORDINATES = Coordinates(None, None)
+
+
+def _intern(value: Any) -> Any:
+    """
+    intern the strings repeated across listings (cities and neighborhoods)
+    so that every listing shares a single copy of them.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
 
 
 def _strip_currency(price) -> int:
     return int(str(price).strip("$"))
 
 
-@attr.s
+@attr.s(slots=True)
 class Stuff:
     """
     Stuff object is represents a Craigslist listing.
+
+    Listings are slotted (no per instance `__dict__`), their neighborhood
+    and city strings are interned and unknown coordinates are the shared
+    `NO_COORDINATES`, as a search or a db read can hold many thousands.
     """
     url: str = attr.ib()
     title: str = attr.ib()
-    time: datetime = attr.ib()
+    time: Optional[datetime] = attr.ib()
     price: int = attr.ib(converter=_strip_currency)
-    neighborhood: str = attr.ib()
-    city: str = attr.ib()
-    image_urls: List[str] = attr.ib(default=None)
-    coordinates: Coordinates = attr.ib(default=None)
+    neighborhood: Optional[str] = attr.ib(converter=_intern)
+    city: str = attr.ib(converter=_intern)
+    image_urls: Optional[List[str]] = attr.ib(default=None)  # None until enriched
+    coordinates: Optional[Coordinates] = attr.ib(default=None)
     delivered: bool = attr.ib(default=False)
-    id: int = attr.ib(default=None)
+    id: Optional[int] = attr.ib(default=None)
 
     def to_api_dict(self) -> dict:
-        d = attr.asdict(self)
+        """
+        to_api_dict flattens the stuff the way the db stores it,
+        with its coordinates and first image url as columns, and
+        whether it has been enriched (see `stuff.snapshot` to serialize
+        many at once).
+        """
+        d = attr.asdict(self, recurse=False)
+        d["enriched"] = self.image_urls is not None
 
-        d["longitude"] = d["coodinates"]["longitude"]
-        d["latitude"] = d["coodinates"]["latitude"]
-        del d["coodinates"]
+        coordinates = d.pop("coordinates") or NO_COORDINATES
+        d["longitude"] = coordinates.longitude
+        d["latitude"] = coordinates.latitude
 
-        urls = d.get("image_urls", [])
+        urls = d.pop("image_urls") or []
         d["image_url"] = urls[0] if urls else None
-        del d["image_urls"]
         return d
 
     @classmethod
     def from_api_dict(cls, d: dict):
-        d["coodinates"]["longitude"] = d["longitude"]
-        d["coodinates"]["latitude"] = d["latitude"]
-        del d["longitude"]
-        del d["latitude"]
-
-        url = d["image_url"]
-        d["image_urls"] = [url]
-        del d["image_url"]
-        return d
+        """
+        from_api_dict is the reverse of `to_api_dict`, stuff which
+        hasn't been enriched gets None image urls and coordinates back.
+        """
+        d = dict(d)
+        longitude, latitude, url = d.pop("longitude"), d.pop("latitude"), d.pop("image_url")
+        if d.pop("enriched", url is not None):
+            d["coordinates"] = Coordinates.of(longitude, latitude)
+            d["image_urls"] = [url] if url else []
+        elif longitude is not None or latitude is not None:
+            d["coordinates"] = Coordinates(longitude, latitude)
+        return cls(**d)
 
     @classmethod
     def parse_item(cls, tag: Tag, city: str):
         """
         parse the <li> tag and return the Stuff
         """
-        a_href = tag.find("a", href=True, text=True)
-        url = a_href["href"]
-        title = a_href.text
-        time = datetime.strptime(tag.find("time")["datetime"], "%Y-%m-%d %H:%M")
-        price = tag.find("span", {"class": "result-price"}).text.strip("$")
-        hood_tag = tag.find("span", {"class": "result-hood"})
-        hood = hood_tag.text.strip(" ()") if hood_tag else None
-        return cls(url=url, title=title, time=time, price=price, neighborhood=hood, city=city)
+        return cls.from_row(soup_row(tag), city)
+
+    @classmethod
+    def from_row(cls, row: ListingRow, city: str):
+        """
+        from_row returns the Stuff of a listing parsed by any `stuff.parsers.Parser`
+        """
+        return cls(
+            url=row.url,
+            title=row.title,
+            time=datetime.strptime(row.time, "%Y-%m-%d %H:%M"),
+            price=row.price.strip("$"),
+            neighborhood=row.neighborhood,
+            city=city,
+        )
 
     def parse_details(self, page: Tag):
         """
         Populate the Stuff with with that item's individual page's information
         """
-        img_tags = page.find_all("img", src=True)
-        self.image_urls = [img["src"] for img in img_tags]
-        map_div = page.find("div", {"id": "map"})
-        if not map_div:
+        self.apply_details(soup_details(page))
+
+    def apply_details(self, details: ItemDetails):
+        self.image_urls = details.image_urls
+        if details.longitude is None or details.latitude is None:
             return
-        coord = Coordinates(
-            longitude=map_div["data-longitude"],
-            latitude=map_div["data-latitude"],
+        self.coordinates = Coordinates.of(
+            longitude=details.longitude,
+            latitude=details.latitude,
         )
-        self.coordinates = coord
@@ -1,24 +1,58 @@
-from typing import List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Set
+import sqlite3
 import attr
 from datetime import datetime
 
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, event, inspect, select, text
+from sqlalchemy.dialects import postgresql
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
 from sqlalchemy.engine import Engine
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Index
+from sqlalchemy.sql import expression
+from sqlalchemy.sql.elements import BindParameter
 
 from stuff.core import Coordinates, Stuff as ApiStuff
 from stuff.constants import Region
 
 Base = declarative_base()
 
+IN_CHUNK_SIZE = 500  # values per IN (...), older sqlite allows 999 parameters
+SQLITE_MAX_PARAMETERS = 999
+# sqlite returns rows from an INSERT since 3.35
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+SQLITE_PROFILES = {
+    # write ahead logging lets readers and the writer work concurrently, and with
+    # synchronous=NORMAL commits don't wait for an fsync (a crash may lose the
+    # last commits, never corrupt the db)
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # KiB, i.e. 64MiB
+        "busy_timeout": 5000,  # ms to wait for another writer
+        "temp_store": "MEMORY",
+    },
+}
+
 
 class DBStuff(Base):  # type: ignore
     __tablename__ = 'stuff'
+    __table_args__ = (
+        # the reads filter on a column and page through it recent -> oldest,
+        # so they walk an index for just the rows they return, rather than
+        # scanning and sorting the table
+        Index("ix_stuff_delivered_time", "delivered", "time"),
+        Index("ix_stuff_city_time", "city", "time"),
+        Index("ix_stuff_enriched_time", "enriched", "time"),
+        Index("ix_stuff_time", "time"),
+    )
     id = Column(Integer, primary_key=True)
     title = Column("title", String, nullable=False)
     url = Column("url", String, nullable=False, unique=True)
@@ -30,6 +64,8 @@ class DBStuff(Base):  # type: ignore
     latitude = Column('latitude', Float)
     image_url = Column('image_url', String)  # TODO: use relation to make image_urls
     delivered = Column('delivered', Boolean, default=False)
+    # whether the item's page has been visited for its images and coordinates
+    enriched = Column('enriched', Boolean, default=False, server_default=expression.false(), nullable=False)
 
     @classmethod
     def from_api_model(cls, stuff: ApiStuff):
@@ -45,8 +81,17 @@ class DBStuff(Base):  # type: ignore
             latitude=stuff.coordinates.latitude if stuff.coordinates else None,
             image_url=stuff.image_urls[0] if stuff.image_urls else None,
             delivered=stuff.delivered,
+            enriched=stuff.image_urls is not None,
         )
 
+    def to_row(self) -> dict:
+        """the values of the row's columns, keyed by column, for core inserts"""
+        return {
+            prop.columns[0].key: getattr(self, prop.key)
+            for prop in inspect(DBStuff).column_attrs
+            if prop.key != "id"
+        }
+
     def to_api_model(self):
         return ApiStuff(
             id=self.id,
@@ -56,8 +101,8 @@ class DBStuff(Base):  # type: ignore
             price=self.price,
             neighborhood=self.neighborhood,
             city=Region(self.city),
-            coordinates=Coordinates(longitude=self.longitude, latitude=self.latitude),
-            image_urls=[] if not self.image_url else [self.image_url],
+            coordinates=Coordinates.of(longitude=self.longitude, latitude=self.latitude),
+            image_urls=None if not self.enriched else [] if not self.image_url else [self.image_url],
             delivered=self.delivered,
         )
 
@@ -71,11 +116,62 @@ class DBClient:
 
     @classmethod
     def new(cls, db_path):
-        engine = create_engine(db_path)
+        """
+        db_path is an sqlalchemy database url, sqlite urls may select
+        one of the `SQLITE_PROFILES`, e.g. sqlite:///stuff.db?profile=fast
+        """
+        url = make_url(db_path)
+        profile = url.query.pop("profile", None)
+        if profile is None:
+            return cls(create_engine(url))
+        if url.get_backend_name() != "sqlite" or profile not in SQLITE_PROFILES:
+            raise ValueError("unknown db profile {} for {}".format(profile, url.get_backend_name()))
+
+        in_memory = url.database in (None, "", ":memory:")
+        kwargs = {}
+        if not in_memory:
+            # connections (and their page cache) are kept rather than reopened per session
+            kwargs = dict(poolclass=QueuePool, pool_size=5, max_overflow=10)
+            kwargs["connect_args"] = dict(check_same_thread=False)
+        engine = create_engine(url, **kwargs)
+        pragmas = SQLITE_PROFILES[profile]
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(connection, _):
+            cursor = connection.cursor()
+            for name, value in pragmas.items():
+                if in_memory and name == "journal_mode":
+                    continue
+                cursor.execute("PRAGMA {} = {}".format(name, value))
+            cursor.close()
+
         return cls(engine)
 
     def create_db(self):
         Base.metadata.create_all(self._engine)
+        self._add_enriched_column()
+        self._add_indexes()
+
+    def _add_enriched_column(self):
+        """
+        dbs created before the enrichment backlog lack its column,
+        their stuff with images or coordinates counts as enriched.
+        """
+        columns = [column["name"] for column in inspect(self._engine).get_columns("stuff")]
+        if "enriched" in columns:
+            return
+        with self._engine.begin() as connection:
+            connection.execute("ALTER TABLE stuff ADD COLUMN enriched BOOLEAN NOT NULL DEFAULT FALSE")
+            connection.execute(
+                "UPDATE stuff SET enriched = (image_url IS NOT NULL OR longititude IS NOT NULL)"
+            )
+
+    def _add_indexes(self):
+        """create_all leaves existing tables, and so their indexes, alone"""
+        existing = {index["name"] for index in inspect(self._engine).get_indexes("stuff")}
+        for index in DBStuff.__table__.indexes:
+            if index.name not in existing:
+                index.create(self._engine)
 
     def drop_db(self):
         connection = self._engine.connect()
@@ -89,13 +185,98 @@ class DBClient:
             session.commit()
             return db_stuff.id
 
-    def get_all_stuff(self) -> List[ApiStuff]:
+    def insert_many(self, stuffs: List[ApiStuff]) -> List[int]:
+        """
+        insert_many inserts a batch of stuff in a single transaction,
+        as one executemany, and returns their ids in order.
+        """
+        if not stuffs:
+            return []
+        table = DBStuff.__table__
+        rows = [DBStuff.from_api_model(stuff).to_row() for stuff in stuffs]
+        ids = {}
+        with self._engine.begin() as connection:
+            connection.execute(table.insert(), rows)
+            urls = [stuff.url for stuff in stuffs]
+            for start in range(0, len(urls), IN_CHUNK_SIZE):
+                query = select([table.c.id, table.c.url]).where(table.c.url.in_(urls[start:start + IN_CHUNK_SIZE]))
+                ids.update({url: _id for _id, url in connection.execute(query)})
+        return [ids[stuff.url] for stuff in stuffs]
+
+    def upsert_many(self, stuffs: List[ApiStuff]) -> List[ApiStuff]:
+        """
+        upsert_many inserts the stuff not stored yet, skipping the urls
+        which are, and returns the stuff it inserted (with their ids).
+
+        On sqlite and postgresql each batch is a single
+        INSERT ... ON CONFLICT (url) DO NOTHING RETURNING, so that
+        clients sharing a db can ingest the same listings concurrently.
+        """
+        if not stuffs:
+            return []
+        rows = [DBStuff.from_api_model(stuff).to_row() for stuff in stuffs]
+        dialect = self._engine.dialect.name
+        ids = {}
+        with self._engine.begin() as connection:
+            if dialect == "postgresql":
+                ids.update(connection.execute(self._postgresql_upsert(rows)).fetchall())
+            elif dialect == "sqlite" and SQLITE_RETURNING:
+                per_statement = max(1, SQLITE_MAX_PARAMETERS // len(rows[0]))
+                for start in range(0, len(rows), per_statement):
+                    ids.update(connection.execute(*self._sqlite_upsert(rows[start:start + per_statement])).fetchall())
+            else:
+                existing: Set[str] = set()
+                urls = [row["url"] for row in rows]
+                for start in range(0, len(urls), IN_CHUNK_SIZE):
+                    query = select([DBStuff.__table__.c.url]).where(
+                        DBStuff.__table__.c.url.in_(urls[start:start + IN_CHUNK_SIZE])
+                    )
+                    existing.update(url for url, in connection.execute(query))
+                new_rows = list({row["url"]: row for row in rows if row["url"] not in existing}.values())
+                for row in new_rows:
+                    ids[row["url"]] = connection.execute(DBStuff.__table__.insert(), row).inserted_primary_key[0]
+
+        inserted = []
+        for stuff in stuffs:
+            if stuff.url in ids:
+                stuff.id = ids.pop(stuff.url)
+                inserted.append(stuff)
+        return inserted
+
+    @staticmethod
+    def _postgresql_upsert(rows: List[dict]):
+        table = DBStuff.__table__
+        return postgresql.insert(table).values(rows).on_conflict_do_nothing(
+            index_elements=[table.c.url],
+        ).returning(table.c.url, table.c.id)
+
+    @staticmethod
+    def _sqlite_upsert(rows: List[dict]):
+        table = DBStuff.__table__
+        columns = list(rows[0])
+        values: List[str] = []
+        parameters: Dict[str, Any] = {}
+        types: List[BindParameter] = []
+        for i, row in enumerate(rows):
+            names = ["{}_{}".format(column, i) for column in columns]
+            values.append("({})".format(", ".join(":" + name for name in names)))
+            parameters.update(zip(names, (row[column] for column in columns)))
+            types.extend(bindparam(name, type_=table.c[column].type) for name, column in zip(names, columns))
+        statement = "INSERT INTO stuff ({}) VALUES {} ON CONFLICT (url) DO NOTHING RETURNING url, id".format(
+            ", ".join(columns), ", ".join(values),
+        )
+        # bound with the columns' types, so values are stored as the orm stores them
+        return text(statement).bindparams(*types), parameters
+
+    def get_all_stuff(self, limit: Optional[int] = None, offset: int = 0) -> List[ApiStuff]:
         """get_all_stuff returns all the stuff ordered recent -> oldest"""
         with self.db_connection() as session:
-            all_stuff = session.query(DBStuff).order_by(DBStuff.time.desc()).all()
+            all_stuff = session.query(DBStuff).order_by(
+                DBStuff.time.desc()
+            ).limit(limit).offset(offset).all()
             return [stuff.to_api_model() for stuff in all_stuff]
 
-    def get_some_stuff(self, location, limit) -> List[ApiStuff]:
+    def get_some_stuff(self, location, limit, offset: int = 0) -> List[ApiStuff]:
         """get_some_stuff returns some of the stuff ordered recent -> oldest"""
         with self.db_connection() as session:
             some_stuff = session.query(
@@ -104,17 +285,44 @@ class DBClient:
                 DBStuff.city == location
             ).order_by(
                 DBStuff.time.desc()
-            ).all()[:limit]
+            ).limit(limit).offset(offset).all()
             return [stuff.to_api_model() for stuff in some_stuff]
 
-    def get_all_undelivered_stuff(self) -> List[ApiStuff]:
+    def get_all_undelivered_stuff(self, limit: Optional[int] = None, offset: int = 0) -> List[ApiStuff]:
         """get_all_undelivered_stuff returns all the stuff ordered recent -> oldest"""
         with self.db_connection() as session:
             undelivered = session.query(DBStuff).filter_by(
                 delivered=False
-            ).order_by(DBStuff.time.desc()).all()
+            ).order_by(DBStuff.time.desc()).limit(limit).offset(offset).all()
             return [stuff.to_api_model() for stuff in undelivered]
 
+    def get_unenriched_stuff(self, limit: Optional[int] = None, offset: int = 0) -> List[ApiStuff]:
+        """get_unenriched_stuff returns the stuff waiting to be enriched ordered recent -> oldest"""
+        with self.db_connection() as session:
+            unenriched = session.query(DBStuff).filter_by(
+                enriched=False
+            ).order_by(DBStuff.time.desc()).limit(limit).offset(offset).all()
+            return [stuff.to_api_model() for stuff in unenriched]
+
+    def update_details(self, enriched: List[ApiStuff]):
+        """
+        update_details writes back the images and coordinates of enriched stuff,
+        all in one transaction, and takes it off the enrichment backlog.
+        """
+        mappings = []
+        for stuff in enriched:
+            db_stuff = DBStuff.from_api_model(stuff)
+            mappings.append(dict(
+                id=stuff.id,
+                image_url=db_stuff.image_url,
+                longitude=db_stuff.longitude,
+                latitude=db_stuff.latitude,
+                enriched=True,
+            ))
+        with self.db_connection() as session:
+            session.bulk_update_mappings(DBStuff, mappings)
+            session.commit()
+
     def get_stuff_by_id(self, _id) -> Optional[ApiStuff]:
         with self.db_connection() as session:
             stuff = session.query(DBStuff).get(_id)
@@ -130,6 +338,47 @@ class DBClient:
                 return db_stuff.to_api_model()
             return None
 
+    def existing_urls(self, urls: Iterable[str]) -> Set[str]:
+        """existing_urls returns which of the urls are stored, in chunked IN queries"""
+        urls = list(urls)
+        table = DBStuff.__table__
+        existing: Set[str] = set()
+        with self._engine.connect() as connection:
+            for start in range(0, len(urls), IN_CHUNK_SIZE):
+                query = select([table.c.url]).where(table.c.url.in_(urls[start:start + IN_CHUNK_SIZE]))
+                existing.update(url for url, in connection.execute(query))
+        return existing
+
+    def get_urls(self) -> Set[str]:
+        """get_urls returns the urls of all the stuff"""
+        with self._engine.connect() as connection:
+            return {url for url, in connection.execute(select([DBStuff.__table__.c.url]))}
+
+    def update_fields(self, ids: Iterable[int], **columns) -> int:
+        """
+        update_fields sets the given columns (by attribute name, e.g. delivered=True)
+        of the stuff with the ids, in one UPDATE ... WHERE id IN (...) per
+        `IN_CHUNK_SIZE` ids, and returns the number of rows updated.
+        """
+        ids = list(ids)
+        if not ids or not columns:
+            return 0
+        attributes = inspect(DBStuff).column_attrs
+        unknown = set(columns) - set(attributes.keys())
+        if unknown:
+            raise TypeError("unknown stuff columns: {}".format(", ".join(sorted(unknown))))
+        values = {attributes[name].columns[0]: value for name, value in columns.items()}
+        table = DBStuff.__table__
+        updated = 0
+        with self._engine.begin() as connection:
+            for start in range(0, len(ids), IN_CHUNK_SIZE):
+                statement = table.update().where(table.c.id.in_(ids[start:start + IN_CHUNK_SIZE])).values(values)
+                updated += connection.execute(statement).rowcount
+        return updated
+
+    def mark_delivered(self, ids: Iterable[int]) -> int:
+        return self.update_fields(ids, delivered=True)
+
     def update_stuff(self, update_stuff: ApiStuff) -> ApiStuff:
         db_stuff = DBStuff.from_api_model(update_stuff)
         with self.db_connection() as session:
@@ -139,11 +388,12 @@ class DBClient:
             stuff.time = db_stuff.time
             stuff.price = db_stuff.price
             stuff.neighborhood = db_stuff.neighborhood
-            stuff.city = db_stuff.city.value
+            stuff.city = Region(db_stuff.city).value
             stuff.longitude = db_stuff.longitude
             stuff.latitude = db_stuff.latitude
             stuff.image_url = db_stuff.image_url
             stuff.delivered = db_stuff.delivered
+            stuff.enriched = db_stuff.enriched
             session.commit()
             return update_stuff
 
@@ -0,0 +1,147 @@
+"""Hold a batch of listings column-wise.
+
+An `Inventory` keeps each field of many `Stuff` in its own NumPy array,
+so that filtering, sorting and summing thousands of listings are array
+operations rather than a Python loop over objects:
+
+    inventory = Inventory.from_stuff(client.db_client.get_all_stuff())
+    cheap = inventory[inventory.prices_between(0, 20) & inventory.since(yesterday)]
+    nearby = cheap[cheap.within(south=40.57, west=-74.04, north=40.74, east=-73.83)]
+    nearby.sort_by("time", descending=True).to_stuff()
+
+NumPy is optional (`pip install stuff[columnar]`).
+"""
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+import math
+
+import attr
+import numpy as np
+
+from stuff.core import NO_COORDINATES, Coordinates, Stuff
+
+
+NO_ID = -1
+COLUMNS = [
+    "urls", "titles", "times", "prices", "neighborhoods", "cities",
+    "longitudes", "latitudes", "image_urls", "delivered", "ids", "has_coordinates",
+]
+SORT_KEYS = {
+    "url": "urls", "title": "titles", "time": "times", "price": "prices",
+    "city": "cities", "longitude": "longitudes", "latitude": "latitudes", "id": "ids",
+}
+
+
+def _float(value) -> float:
+    return float(value) if value is not None else np.nan
+
+
+def _optional(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def _object_array(values: list) -> np.ndarray:
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+@attr.s(eq=False)
+class Inventory:
+    """
+    Inventory is a batch of listings stored as columns:
+    unknown coordinates are NaN, unknown ids `NO_ID` and unknown
+    times NaT, strings and image urls are object arrays.
+    Cities are stored as strings.
+    """
+    urls: np.ndarray = attr.ib()
+    titles: np.ndarray = attr.ib()
+    times: np.ndarray = attr.ib()  # datetime64[us]
+    prices: np.ndarray = attr.ib()  # int64
+    neighborhoods: np.ndarray = attr.ib()
+    cities: np.ndarray = attr.ib()
+    longitudes: np.ndarray = attr.ib()  # float64
+    latitudes: np.ndarray = attr.ib()  # float64
+    image_urls: np.ndarray = attr.ib()
+    delivered: np.ndarray = attr.ib()  # bool
+    ids: np.ndarray = attr.ib()  # int64
+    # bool, False for stuff whose coordinates were never looked up (None)
+    has_coordinates: np.ndarray = attr.ib()
+
+    @classmethod
+    def from_stuff(cls, stuff: Iterable[Stuff]) -> "Inventory":
+        stuff = list(stuff)
+        coordinates = [item.coordinates or NO_COORDINATES for item in stuff]
+        return cls(
+            urls=_object_array([item.url for item in stuff]),
+            titles=_object_array([item.title for item in stuff]),
+            times=np.array([item.time for item in stuff], dtype="datetime64[us]"),
+            prices=np.array([item.price for item in stuff], dtype=np.int64),
+            neighborhoods=_object_array([item.neighborhood for item in stuff]),
+            cities=_object_array([getattr(item.city, "value", item.city) for item in stuff]),
+            longitudes=np.array([_float(c.longitude) for c in coordinates], dtype=np.float64),
+            latitudes=np.array([_float(c.latitude) for c in coordinates], dtype=np.float64),
+            image_urls=_object_array([item.image_urls for item in stuff]),
+            delivered=np.array([bool(item.delivered) for item in stuff], dtype=bool),
+            ids=np.array([NO_ID if item.id is None else item.id for item in stuff], dtype=np.int64),
+            has_coordinates=np.array([item.coordinates is not None for item in stuff], dtype=bool),
+        )
+
+    def to_stuff(self) -> List[Stuff]:
+        """unknown coordinates come back as `NO_COORDINATES`, as from the db"""
+        return [
+            Stuff(
+                url=url, title=title, time=time, price=price,
+                neighborhood=neighborhood, city=city, image_urls=image_urls,
+                coordinates=Coordinates.of(_optional(longitude), _optional(latitude)) if looked_up else None,
+                delivered=delivered, id=None if _id == NO_ID else _id,
+            )
+            for (
+                url, title, time, price, neighborhood, city, longitude,
+                latitude, image_urls, delivered, _id, looked_up,
+            ) in zip(
+                self.urls.tolist(), self.titles.tolist(), self.times.tolist(),
+                self.prices.tolist(), self.neighborhoods.tolist(), self.cities.tolist(),
+                self.longitudes.tolist(), self.latitudes.tolist(), self.image_urls.tolist(),
+                self.delivered.tolist(), self.ids.tolist(), self.has_coordinates.tolist(),
+            )
+        ]
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def __iter__(self) -> Iterator[Stuff]:
+        """iterating yields `Stuff`"""
+        return iter(self.to_stuff())
+
+    def __getitem__(self, selection) -> "Inventory":
+        """select listings by boolean mask, indices or slice"""
+        return Inventory(*[getattr(self, column)[selection] for column in COLUMNS])
+
+    def prices_between(self, low: Optional[int] = None, high: Optional[int] = None) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if low is not None:
+            mask &= self.prices >= low
+        if high is not None:
+            mask &= self.prices <= high
+        return mask
+
+    def since(self, start: datetime, end: Optional[datetime] = None) -> np.ndarray:
+        mask = self.times >= np.datetime64(start, "us")
+        if end is not None:
+            mask &= self.times < np.datetime64(end, "us")
+        return mask
+
+    def within(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """the listings inside the bounding box, listings without coordinates never are"""
+        return (
+            (self.latitudes >= south) & (self.latitudes <= north)
+            & (self.longitudes >= west) & (self.longitudes <= east)
+        )
+
+    def sort_by(self, key: str, descending: bool = False) -> "Inventory":
+        """sort_by is stable either way, listings which tie keep their order"""
+        column = getattr(self, SORT_KEYS[key])
+        if not descending:
+            return self[np.argsort(column, kind="stable")]
+        return self[len(self) - 1 - np.argsort(column[::-1], kind="stable")[::-1]]
@@ -0,0 +1,361 @@
+"""Parse craigslist pages with interchangeable HTML parsers.
+
+A `Parser` turns the raw bytes of a results page into `ListingRow`s
+and of an item page into `ItemDetails`, all backends sharing the same
+extraction rules as the original BeautifulSoup code:
+
+- the url and title of a listing come from its first <a href> holding only text
+- the time from the first <time datetime>
+- the price from the first span.result-price, the neighborhood from span.result-hood
+- the item's images from every <img src> and its coordinates from div#map
+
+BeautifulSoup's pure python `html.parser` is always available, lxml and
+selectolax are optional (`pip install stuff[fast]`) and much faster.
+
+`parse_rows` and `parse_item_details` take only bytes and a backend's
+name and return plain tuples, so pages can be parsed on a process pool.
+"""
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Pattern, Union
+import abc
+import html
+import re
+
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+
+
+ENCODING = "utf-8"  # craigslist serves every page in utf-8
+
+
+class ListingRow(NamedTuple):
+    url: str
+    title: str
+    time: str
+    price: str
+    neighborhood: Optional[str]
+
+
+class ItemDetails(NamedTuple):
+    image_urls: List[str]
+    longitude: Optional[str]
+    latitude: Optional[str]
+
+
+def _strip_hood(text: Optional[str]) -> Optional[str]:
+    return text.strip(" ()") if text is not None else None
+
+
+class Parser(abc.ABC):
+    name: str = ""
+
+    @abc.abstractmethod
+    def list_items(self, content: bytes) -> Iterable[Any]:
+        """the <li> elements of a results page, in the backend's own type"""
+
+    @abc.abstractmethod
+    def item_url(self, list_item) -> str:
+        pass
+
+    @abc.abstractmethod
+    def parse_row(self, list_item) -> ListingRow:
+        pass
+
+    @abc.abstractmethod
+    def parse_details(self, content: bytes) -> ItemDetails:
+        pass
+
+    def rows(self, content: bytes) -> List[ListingRow]:
+        return [self.parse_row(list_item) for list_item in self.list_items(content)]
+
+
+def soup_item_link(tag: Tag) -> Optional[Tag]:
+    return tag.find("a", href=True, string=True)
+
+
+def _found(tag: Optional[Tag], what: str) -> Tag:
+    if tag is None:
+        raise ValueError("listing without {}".format(what))
+    return tag
+
+
+def soup_row(tag: Tag) -> ListingRow:
+    a_href = _found(soup_item_link(tag), "a link")
+    hood_tag = tag.find("span", {"class": "result-hood"})
+    return ListingRow(
+        url=str(a_href["href"]),
+        title=a_href.text,
+        time=str(_found(tag.find("time"), "a time")["datetime"]),
+        price=_found(tag.find("span", {"class": "result-price"}), "a price").text,
+        neighborhood=_strip_hood(hood_tag.text) if hood_tag else None,
+    )
+
+
+def soup_details(page: Tag) -> ItemDetails:
+    image_urls = [str(img["src"]) for img in page.find_all("img", src=True)]
+    map_div = page.find("div", {"id": "map"})
+    if not map_div:
+        return ItemDetails(image_urls, None, None)
+    return ItemDetails(image_urls, str(map_div["data-longitude"]), str(map_div["data-latitude"]))
+
+
+def _soup(content) -> BeautifulSoup:
+    if isinstance(content, bytes):
+        return BeautifulSoup(content, features="html.parser", from_encoding=ENCODING)
+    return BeautifulSoup(content, features="html.parser")
+
+
+class SoupParser(Parser):
+    name = "html.parser"
+
+    def list_items(self, content):
+        soup = _soup(content)
+        ul = soup.find("ul", {"class": "rows"})
+        return ul.find_all("li") if ul else []
+
+    def item_url(self, list_item):
+        return str(_found(soup_item_link(list_item), "a link")["href"])
+
+    def parse_row(self, list_item):
+        return soup_row(list_item)
+
+    def parse_details(self, content):
+        return soup_details(_soup(content))
+
+
+def _has_class(name: str) -> str:
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+class LxmlParser(Parser):
+    name = "lxml"
+
+    def __init__(self):
+        from lxml import etree, html
+        self._html_parser = html.HTMLParser(encoding=ENCODING)
+        self._fromstring = html.fromstring
+        self._rows = etree.XPath("(//ul[{}])[1]//li".format(_has_class("rows")))
+        self._link = etree.XPath(".//a[@href][not(*)][text()][1]")
+        self._time = etree.XPath("(.//time)[1]/@datetime")
+        self._price = etree.XPath("(.//span[{}])[1]".format(_has_class("result-price")))
+        self._hood = etree.XPath("(.//span[{}])[1]".format(_has_class("result-hood")))
+        self._images = etree.XPath("//img/@src")
+        self._map = etree.XPath("(//div[@id='map'])[1]")
+
+    def _document(self, content):
+        if isinstance(content, str):
+            content = content.encode(ENCODING)
+        return self._fromstring(content, parser=self._html_parser)
+
+    def list_items(self, content):
+        return self._rows(self._document(content))
+
+    def item_url(self, list_item):
+        return self._link(list_item)[0].get("href")
+
+    def parse_row(self, list_item):
+        link = self._link(list_item)[0]
+        hood = self._hood(list_item)
+        return ListingRow(
+            url=link.get("href"),
+            title=link.text,
+            time=self._time(list_item)[0],
+            price=self._price(list_item)[0].text_content(),
+            neighborhood=_strip_hood(hood[0].text_content()) if hood else None,
+        )
+
+    def parse_details(self, content):
+        page = self._document(content)
+        image_urls = [str(src) for src in self._images(page)]
+        map_div = self._map(page)
+        if not map_div:
+            return ItemDetails(image_urls, None, None)
+        return ItemDetails(image_urls, map_div[0].get("data-longitude"), map_div[0].get("data-latitude"))
+
+
+class SelectolaxParser(Parser):
+    name = "selectolax"
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._html_parser = LexborHTMLParser
+
+    def list_items(self, content):
+        ul = self._html_parser(content).css_first("ul.rows")
+        return ul.css("li") if ul else []
+
+    @staticmethod
+    def _link(list_item):
+        for a in list_item.css("a[href]"):
+            if a.child is not None and not any(True for _ in a.iter()):
+                return a
+
+    def item_url(self, list_item):
+        return self._link(list_item).attributes["href"]
+
+    def parse_row(self, list_item):
+        link = self._link(list_item)
+        hood = list_item.css_first("span.result-hood")
+        return ListingRow(
+            url=link.attributes["href"],
+            title=link.text(),
+            time=list_item.css_first("time").attributes["datetime"],
+            price=list_item.css_first("span.result-price").text(),
+            neighborhood=_strip_hood(hood.text()) if hood else None,
+        )
+
+    def parse_details(self, content):
+        page = self._html_parser(content)
+        image_urls = [img.attributes["src"] for img in page.css("img[src]")]
+        map_div = page.css_first("div#map")
+        if not map_div:
+            return ItemDetails(image_urls, None, None)
+        return ItemDetails(
+            image_urls, map_div.attributes.get("data-longitude"), map_div.attributes.get("data-latitude"),
+        )
+
+
+_IMG_TAG = re.compile(rb"<img\b[^>]*>")
+
+
+def _tag_with_id(tag: bytes, _id: bytes) -> Pattern[bytes]:
+    """a whole opening tag whose id is exactly `_id`, quoted or not"""
+    return re.compile(
+        rb"<" + tag + rb"""\b[^>]*?\sid\s*=\s*(?:"ID"|'ID'|ID(?=[\s/>]))[^>]*>""".replace(b"ID", _id)
+    )
+
+
+_MAP_TAG = _tag_with_id(rb"div", rb"map")
+_POSTING_BODY = _tag_with_id(rb"\w+", rb"postingbody")
+_ATTRIBUTE = re.compile(rb"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+_IGNORED = [(b"<!--", b"-->"), (b"<script", b"</script")]
+
+
+def _is_ignored(page: Union[bytes, bytearray], position: int) -> bool:
+    """whether the tag at position is inside a comment or a script"""
+    for start, end in _IGNORED:
+        opened = page.rfind(start, 0, position)
+        if opened != -1 and page.find(end, opened, position) == -1:
+            return True
+    return False
+
+
+def _attributes(tag: bytes) -> Dict[str, str]:
+    return {
+        name.decode(ENCODING, "replace").lower(): html.unescape(
+            (double or single or bare).decode(ENCODING, "replace")
+        )
+        for name, double, single, bare in _ATTRIBUTE.findall(tag)
+    }
+
+
+class DetailsScanner:
+    """
+    DetailsScanner pulls the `ItemDetails` out of an item page as it is
+    read, without building a tree, and says when the rest of the page
+    can go unread.
+
+    On craigslist's item page the gallery comes first, then div#map, then
+    the posting body, so once the map div (or, for a posting without a
+    location, the posting body) has been seen every img has been too.
+    Like craigslist's markup, the scanner expects lowercase tags and attributes.
+
+    scanner = DetailsScanner()
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    details = scanner.details()  # None means the page has to be fully parsed
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.done = False
+        self._stop = 0
+
+    def _find(self, tag: Pattern[bytes], start: int) -> Optional[int]:
+        """the end of the first `tag` from start which isn't commented out or scripted"""
+        for match in tag.finditer(self.buffer, start):
+            if not _is_ignored(self.buffer, match.start()):
+                return match.end()
+        return None
+
+    def feed(self, chunk: bytes) -> bool:
+        # a tag may straddle chunks, so rescan from the last tag opened
+        start = max(0, self.buffer.rfind(b"<"))
+        self.buffer += chunk
+        stop = self._find(_MAP_TAG, start) or self._find(_POSTING_BODY, start)
+        if stop is not None:
+            self._stop = stop
+            self.done = True
+        return self.done
+
+    def details(self) -> Optional[ItemDetails]:
+        if not self.done:
+            return None
+        page = bytes(self.buffer[:self._stop])
+        image_urls = []
+        for img in _IMG_TAG.finditer(page):
+            src = _attributes(img.group(0)).get("src")
+            if src is not None and not _is_ignored(page, img.start()):
+                image_urls.append(src)
+        map_tag = next((
+            tag for tag in _MAP_TAG.finditer(page) if not _is_ignored(page, tag.start())
+        ), None)
+        if not map_tag:
+            return ItemDetails(image_urls, None, None)
+        attributes = _attributes(map_tag.group(0))
+        if "data-longitude" not in attributes or "data-latitude" not in attributes:
+            return None
+        return ItemDetails(image_urls, attributes["data-longitude"], attributes["data-latitude"])
+
+
+def scan_details(content: bytes) -> Optional[ItemDetails]:
+    scanner = DetailsScanner()
+    scanner.feed(content)
+    return scanner.details()
+
+
+PARSERS: Dict[str, Callable[[], Parser]] = {
+    SelectolaxParser.name: SelectolaxParser,
+    LxmlParser.name: LxmlParser,
+    SoupParser.name: SoupParser,
+}
+
+
+def get_parser(name: Optional[str] = None) -> Parser:
+    """
+    get_parser returns the parser backend called `name`,
+    or by default the fastest one installed.
+    """
+    if name:
+        return PARSERS[name]()
+    for parser in PARSERS.values():
+        try:
+            return parser()
+        except ImportError:
+            continue
+    return SoupParser()
+
+
+_process_parsers: Dict[Optional[str], Parser] = {}
+
+
+def _process_parser(name: Optional[str]) -> Parser:
+    """the backend called `name`, created once per process"""
+    if name not in _process_parsers:
+        _process_parsers[name] = get_parser(name)
+    return _process_parsers[name]
+
+
+def parse_rows(content: bytes, parser_name: Optional[str] = None) -> List[ListingRow]:
+    """
+    parse_rows is `Parser.rows` for a process pool:
+
+    with ProcessPoolExecutor() as processes:
+        rows = processes.submit(parse_rows, content, "lxml").result()
+    """
+    return _process_parser(parser_name).rows(content)
+
+
+def parse_item_details(content: bytes, parser_name: Optional[str] = None) -> ItemDetails:
+    """parse_item_details is `Parser.parse_details` for a process pool"""
+    return _process_parser(parser_name).parse_details(content)
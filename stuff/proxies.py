@@ -0,0 +1,90 @@
+from typing import Callable, Dict, Iterable, Optional
+import random
+import threading
+import time
+
+import attr
+
+
+@attr.s
+class ProxyHealth:
+    """the moving averages of a proxy's latency (seconds) and error rate (0 to 1)"""
+    proxy: str = attr.ib()
+    latency: float = attr.ib(default=0.0)
+    error_rate: float = attr.ib(default=0.0)
+    requests: int = attr.ib(default=0)
+    ejected_until: float = attr.ib(default=float("-inf"))
+
+    @property
+    def score(self) -> float:
+        """lower is better, untried proxies score 0 so they all get a turn"""
+        return self.latency * (1 + 4 * self.error_rate)
+
+
+@attr.s
+class ProxyPool:
+    """
+    ProxyPool rotates requests across proxies, preferring the fast and
+    reliable ones and temporarily ejecting the failing ones.
+
+    Each request goes through the better scoring of two healthy proxies
+    picked at random (the "power of two choices"), which favors the fastest
+    without sending everything through a single proxy. A proxy whose error
+    rate passes `max_error_rate` is ejected for `eject_seconds` and comes
+    back on probation. If every proxy is ejected, the one due back first is used.
+
+    examples:
+
+    pool = ProxyPool.new(["http://1.1.1.1:3129", "http://2.2.2.2:3129"])
+    proxy = pool.choose()
+    requests.get(url, proxies=ProxyPool.as_requests(proxy))
+    pool.report(proxy, ok=True, elapsed=0.4)
+    """
+    proxies: Dict[str, ProxyHealth] = attr.ib()
+    alpha: float = attr.ib(default=0.3)
+    max_error_rate: float = attr.ib(default=0.5)
+    min_requests: int = attr.ib(default=3)
+    eject_seconds: float = attr.ib(default=300.0)
+    clock: Callable[[], float] = attr.ib(default=time.monotonic, repr=False)
+    _random: random.Random = attr.ib(factory=random.Random, repr=False)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False)
+
+    @classmethod
+    def new(cls, proxies: Iterable[str], **kwargs):
+        return cls({proxy: ProxyHealth(proxy) for proxy in proxies}, **kwargs)
+
+    @staticmethod
+    def as_requests(proxy: str) -> dict:
+        return {"http": proxy, "https": proxy}
+
+    def healthy(self):
+        now = self.clock()
+        return [health for health in self.proxies.values() if health.ejected_until <= now]
+
+    def choose(self) -> Optional[str]:
+        with self._lock:
+            healthy = self.healthy()
+            if not healthy:
+                if not self.proxies:
+                    return None
+                return min(self.proxies.values(), key=lambda health: health.ejected_until).proxy
+            candidates = self._random.sample(healthy, min(2, len(healthy)))
+            return min(candidates, key=lambda health: health.score).proxy
+
+    def report(self, proxy: str, ok: bool, elapsed: float):
+        """
+        report the outcome of a request through the proxy,
+        `ok` is False when the request failed or was refused.
+        """
+        with self._lock:
+            health = self.proxies[proxy]
+            if health.requests:
+                health.latency += self.alpha * (elapsed - health.latency)
+                health.error_rate += self.alpha * ((0.0 if ok else 1.0) - health.error_rate)
+            else:
+                health.latency = elapsed
+                health.error_rate = 0.0 if ok else 1.0
+            health.requests += 1
+            if health.requests >= self.min_requests and health.error_rate > self.max_error_rate:
+                health.ejected_until = self.clock() + self.eject_seconds
+                health.error_rate = self.max_error_rate / 2  # on probation when it's back
@@ -0,0 +1,118 @@
+"""Spot reposts of recent listings.
+
+Posters repost the same thing under a new url, often with the title
+slightly reworded. Each listing is fingerprinted with a 64 bit SimHash
+of its normalized title words, so that similar titles get fingerprints
+a few bits apart, and a `RepostIndex` finds the recent listings in the
+same neighborhood at the same price within `max_distance` bits of a new one.
+
+The fingerprints are split in `max_distance + 1` bands: two fingerprints
+that close agree on at least one whole band, so a lookup only compares
+against the listings sharing a band rather than against every listing.
+"""
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+import attr
+
+from stuff.core import Stuff
+
+
+BITS = 64
+_WORD = re.compile(r"\w+")
+# words which say nothing about the item itself
+STOP_WORDS = {"free", "a", "an", "and", "the", "of", "for", "in", "with", "to", "curb", "alert", "must", "go"}
+
+
+def features(stuff: Stuff) -> List[str]:
+    words = [word for word in _WORD.findall(stuff.title.lower()) if word not in STOP_WORDS]
+    return words + [" ".join(pair) for pair in zip(words, words[1:])]
+
+
+def context(stuff: Stuff) -> Tuple[str, int]:
+    """a repost has the same neighborhood and price as its original"""
+    return (stuff.neighborhood or "").lower().strip(), stuff.price
+
+
+def simhash(tokens: Iterable[str]) -> int:
+    counts = [0] * BITS
+    for token in tokens:
+        value = int.from_bytes(blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(BITS):
+            counts[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(BITS) if counts[bit] > 0)
+
+
+def fingerprint(stuff: Stuff) -> int:
+    return simhash(features(stuff))
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@attr.s
+class RepostIndex:
+    """
+    RepostIndex remembers the fingerprints of the last `max_entries`
+    listings and tells whether a new one is a near duplicate of them.
+
+    examples:
+
+    reposts = RepostIndex()
+    original = reposts.check(stuff)  # the url it reposts, or None
+    if original is None:
+        reposts.add(stuff)
+    """
+    max_distance: int = attr.ib(default=3)
+    max_entries: int = attr.ib(default=10000)
+    entries: "OrderedDict[str, Tuple[Tuple[str, int], int]]" = attr.ib(factory=OrderedDict, repr=False)
+    bands: List[Dict[tuple, List[str]]] = attr.ib(factory=list, repr=False)
+
+    def __attrs_post_init__(self):
+        self.bands = [{} for _ in range(self.max_distance + 1)]
+
+    def _bands(self, where: Tuple[str, int], value: int) -> Iterable[Tuple[Dict[tuple, List[str]], tuple]]:
+        width = BITS // len(self.bands)
+        for i, band in enumerate(self.bands):
+            shift = i * width
+            size = width if i < len(self.bands) - 1 else BITS - shift
+            yield band, (where, value >> shift & ((1 << size) - 1))
+
+    def check(self, stuff: Stuff) -> Optional[str]:
+        """
+        check returns the url of the listing `stuff` is a repost of, if any.
+        A title made only of stop words ("FREE!!", "Curb alert") says nothing
+        to compare, so such a listing is never a repost.
+        """
+        if not features(stuff):
+            return None
+        where, value = context(stuff), fingerprint(stuff)
+        for band, key in self._bands(where, value):
+            for url in band.get(key, ()):
+                if url != stuff.url and distance(value, self.entries[url][1]) <= self.max_distance:
+                    return url
+        return None
+
+    def add(self, stuff: Stuff):
+        if stuff.url in self.entries or not features(stuff):
+            return
+        where, value = context(stuff), fingerprint(stuff)
+        self.entries[stuff.url] = (where, value)
+        for band, key in self._bands(where, value):
+            band.setdefault(key, []).append(stuff.url)
+        if len(self.entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        url, (where, value) = self.entries.popitem(last=False)
+        for band, key in self._bands(where, value):
+            urls = band[key]
+            urls.remove(url)
+            if not urls:
+                del band[key]
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -1,15 +1,29 @@
+from contextlib import closing
 from functools import partial
-from typing import List, Optional
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+import asyncio
 import attr
+import hashlib
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
 from multiprocessing.pool import ThreadPool
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 
-from bs4 import BeautifulSoup
+import aiohttp
 import requests
 
+from stuff.cache import DetailsCache
 from stuff.core import Stuff
 from stuff.constants import Area, Region, Category
+from stuff.parsers import (
+    DetailsScanner, ItemDetails, ListingRow, Parser, get_parser, parse_item_details, parse_rows,
+)
+from stuff.session import DRAIN_LIMIT, SessionPool
+from stuff.throttle import retry_after
+
+
+CHUNK_SIZE = 4096
 
 
 @attr.s
@@ -18,11 +32,38 @@ class Proximinity:
     postal: str = attr.ib()
 
 
+@attr.s
+class PageValidator:
+    """
+    PageValidator is what a Search remembers of a results page
+    in order to tell whether it has changed since it was last fetched.
+    """
+    etag: Optional[str] = attr.ib()
+    last_modified: Optional[str] = attr.ib()
+    digest: str = attr.ib()
+
+
+def _listings_digest(content: bytes) -> str:
+    """
+    hash only the results list, the rest of the page carries
+    tokens which change on every request.
+    """
+    start = content.find(b'<ul class="rows"')
+    end = content.find(b"</ul>", start)
+    if start != -1 and end != -1:
+        content = content[start:end]
+    return hashlib.sha1(content).hexdigest()
+
+
 @attr.s
 class Search:
     """
     Search object is used to construct valid searches on craigslist
     and return inventory of `Stuff` listings from the search.
+
+    Pages are parsed in the calling thread, unless the search is given
+    `processes`, a `concurrent.futures.ProcessPoolExecutor` (or any executor)
+    to parse them on, while fetching stays in this process.
     """
     root: str = attr.ib(default="https://{}.craigslist.org/search/")
     region: Region = attr.ib(default=Region.new_york_city)
@@ -30,9 +71,17 @@ class Search:
     category: Category = attr.ib(default=Category.free)
     query: Optional[str] = attr.ib(default=None)
     proximinity: Optional[Proximinity] = attr.ib(default=None)
-    # size: int = attr.ib(default=None)  # TODO: pagination size, if supporting pagination
+    page_size: int = attr.ib(default=120)
+    session: SessionPool = attr.ib(factory=SessionPool.new, repr=False, eq=False)
+    parser: Parser = attr.ib(factory=get_parser, repr=False, eq=False)
+    cache: Optional[DetailsCache] = attr.ib(default=None, repr=False, eq=False)
+    validators: Dict[str, PageValidator] = attr.ib(factory=dict, repr=False, eq=False)
+    # validators of pages fetched but whose listings aren't stored yet, see `confirm_pages`
+    pending_validators: Dict[str, PageValidator] = attr.ib(factory=dict, repr=False, eq=False)
+    unchanged_count: int = attr.ib(default=0, repr=False, eq=False)
+    processes: Optional[Executor] = attr.ib(default=None, repr=False, eq=False)
 
-    def build_url(self) -> str:
+    def build_url(self, offset: int = 0) -> str:
         base_url = os.path.join(
             self.root.format(self.region.value),
             self.area.value,
@@ -46,39 +95,234 @@ class Search:
                 "search_distance": str(self.proximinity.search_distance),
                 "postal": self.proximinity.postal,
             })
+        if offset:
+            params.update({"s": str(offset)})
         if params:
             url_params = urlencode(params)
             return base_url + "?" + url_params
         else:
             return base_url
 
-    def get_text(self) -> str:
-        url = self.build_url()
-        r = requests.get(url)
+    def get_text(self, offset: int = 0) -> str:
+        url = self.build_url(offset)
+        r = self.session.get(url)
         return r.text
 
-    def get_inventory(self) -> List[Stuff]:
-        soup = BeautifulSoup(self.get_text(), features="html.parser")
-        ul = soup.find("ul", {"class": "rows"})
+    def get_content(self, offset: int = 0) -> bytes:
+        url = self.build_url(offset)
+        r = self.session.get(url)
+        return r.content
+
+    def get_changed_content(self) -> Optional[bytes]:
+        """
+        get_changed_content makes a conditional request for the results page
+        and returns None, counting it in `unchanged_count`, if the page
+        is unchanged since the last time it was fetched.
+
+        A changed page only counts as fetched once `confirm_pages` is called,
+        after its listings are stored, so that a page whose listings never
+        made it is fetched again.
+        """
+        url = self.build_url()
+        validator = self.validators.get(url)
+        headers = {}
+        if validator and validator.etag:
+            headers["If-None-Match"] = validator.etag
+        if validator and validator.last_modified:
+            headers["If-Modified-Since"] = validator.last_modified
+
+        r = self.session.get(url, headers=headers)
+        if r.status_code == 304:
+            self.pending_validators.pop(url, None)
+            self.unchanged_count += 1
+            return None
+        digest = _listings_digest(r.content)
+        latest = PageValidator(
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+            digest=digest,
+        )
+        if validator and validator.digest == digest:
+            self.validators[url] = latest
+            self.pending_validators.pop(url, None)
+            self.unchanged_count += 1
+            return None
+        self.pending_validators[url] = latest
+        return r.content
+
+    def confirm_pages(self):
+        """confirm_pages remembers the pages fetched since, once their listings are stored"""
+        self.validators.update(self.pending_validators)
+        self.pending_validators.clear()
+
+    def get_inventory(
+            self,
+            seen: Optional[Callable[[str], bool]] = None,
+            known_run: Optional[int] = None,
+    ) -> List[Stuff]:
+        return self.parse_inventory(self.get_content(), seen, known_run)
+
+    def poll_inventory(
+            self,
+            seen: Optional[Callable[[str], bool]] = None,
+            known_run: Optional[int] = None,
+    ) -> Optional[List[Stuff]]:
+        """
+        poll_inventory is `get_inventory` for polling,
+        it returns None when the results page hasn't changed.
+        """
+        content = self.get_changed_content()
+        if content is None:
+            return None
+        inventory = self.parse_inventory(content, seen, known_run)
+        self.confirm_pages()
+        return inventory
+
+    def iter_inventory(
+            self,
+            max_pages: int = 25,
+            stop_at: Optional[Callable[[Stuff], bool]] = None,
+    ) -> Iterator[Stuff]:
+        """
+        iter_inventory lazily pages through the search results (newest first),
+        only fetching the next page once the previous one is exhausted.
+
+        Iteration ends after `max_pages`, on a short (last) page, or as soon as
+        `stop_at` returns True for a listing, e.g. on reaching one already seen:
+
+        for stuff in search.iter_inventory(stop_at=lambda s: s.url == last_seen_url):
+            ...
+
+        craigslist doesn't return more than 3000 results, i.e. 25 pages.
+        """
+        for page in range(max_pages):
+            inventory = self.parse_inventory(self.get_content(offset=page * self.page_size))
+            for stuff in inventory:
+                if stop_at and stop_at(stuff):
+                    return
+                yield stuff
+            if len(inventory) < self.page_size:
+                return
+
+    def parse_inventory(
+            self,
+            content: bytes,
+            seen: Optional[Callable[[str], bool]] = None,
+            known_run: Optional[int] = None,
+            known_urls: Optional[Callable[[List[str]], Set[str]]] = None,
+    ) -> List[Stuff]:
+        """
+        parse_inventory parses the listings of a results page.
+
+        When given a `seen` oracle, listings whose url it knows are skipped
+        before being parsed. Because the results are ordered newest first,
+        once `known_run` listings in a row are known the rest are assumed
+        to be known too, and parsing stops there. (A single known listing
+        isn't enough as reposts and bumped listings break the order.)
+
+        `known_urls` is a bulk `seen`: given every url of the page at once
+        it returns those known, e.g. from one db query per page.
+        """
+        if self.processes is not None:
+            rows = self.processes.submit(parse_rows, content, self.parser.name).result()
+            return self.inventory_from_rows(rows, seen, known_run, known_urls)
+        list_items = self.parser.list_items(content)
+        if known_urls:
+            list_items = list(list_items)
+            seen = known_urls([self.parser.item_url(list_item) for list_item in list_items]).__contains__
+        inventory = []
+        run = 0
+        for list_item in list_items:
+            if seen and seen(self.parser.item_url(list_item)):
+                run += 1
+                if known_run and run >= known_run:
+                    break
+                continue
+            run = 0
+            inventory.append(Stuff.from_row(self.parser.parse_row(list_item), self.region.value))
+        return inventory
+
+    def inventory_from_rows(
+            self,
+            rows: List[ListingRow],
+            seen: Optional[Callable[[str], bool]] = None,
+            known_run: Optional[int] = None,
+            known_urls: Optional[Callable[[List[str]], Set[str]]] = None,
+    ) -> List[Stuff]:
+        """inventory_from_rows is `parse_inventory` for rows parsed elsewhere"""
+        if known_urls:
+            seen = known_urls([row.url for row in rows]).__contains__
         inventory = []
-        for list_item in ul.find_all("li"):
-            stuff = Stuff.parse_item(list_item, self.region.value)
-            stuff.city = self.region.value
-            inventory.append(stuff)
+        run = 0
+        for row in rows:
+            if seen and seen(row.url):
+                run += 1
+                if known_run and run >= known_run:
+                    break
+                continue
+            run = 0
+            inventory.append(Stuff.from_row(row, self.region.value))
         return inventory
 
-    @classmethod
-    def enrich_item(cls, item: Stuff, proxies: Optional[dict]):
-        text = requests.get(item.url, proxies=proxies).text
-        item.parse_details(BeautifulSoup(text, features="html.parser"))
+    def parse_details(self, content: bytes) -> ItemDetails:
+        if self.processes is not None:
+            return self.processes.submit(parse_item_details, content, self.parser.name).result()
+        return self.parser.parse_details(content)
+
+    async def aparse_details(self, content: bytes) -> ItemDetails:
+        if self.processes is not None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.processes, parse_item_details, content, self.parser.name)
+        return self.parser.parse_details(content)
+
+    def get_details(self, url: str, proxies: Optional[dict] = None) -> ItemDetails:
+        """
+        get_details streams the item page and stops reading it as soon as
+        the `DetailsScanner` has seen the images and the map, falling back
+        to parsing the whole page when the scanner can't make sense of it.
+
+        Details of the pages fetched successfully are kept in the search's
+        `cache`, if it has one, and read from there next time.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if cached is not None:
+                return cached
+        scanner = DetailsScanner()
+        with closing(self.session.get(url, proxies=proxies, stream=True)) as r:
+            # an error page (throttled, removed...) has no details, the item stays unenriched
+            r.raise_for_status()
+            chunks = r.iter_content(CHUNK_SIZE)
+            for chunk in chunks:
+                if scanner.feed(chunk):
+                    break
+            details = scanner.details()
+            if details is None:
+                details = self.parse_details(bytes(scanner.buffer) + b"".join(chunks))
+            else:
+                self.session.release(r)
+        if self.cache is not None:
+            self.cache.put(url, details)
+        return details
+
+    def enrich_item(self, item: Stuff, proxies: Optional[dict]):
+        item.apply_details(self.get_details(item.url, proxies))
         return item
 
-    @classmethod
+    def _enrich_or_skip(self, item: Stuff, proxies: Optional[dict]):
+        """the item is left unenriched when its page fails to load"""
+        try:
+            return self.enrich_item(item, proxies)
+        except requests.RequestException:
+            return item
+
     def enrich_inventory(
-            cls,
+            self,
             stuff: List[Stuff],
             proxies: Optional[dict] = None,
             num_threads: int = 4,
+            deadline: Optional[float] = None,
+            hedge_after: Optional[float] = None,
     ) -> List[Stuff]:
         """
         certain details of stuff are only accessible after visiting
@@ -87,8 +331,152 @@ class Search:
         the Coordinates and Image Urls are all "enriched"
 
         Because this function makes between 1 and 120 requests, it's executed
-        asynchronously with asyncio.
+        on a pool of threads (see `aenrich_inventory` for the asyncio version).
+
+        The worker threads share the search's `SessionPool`, so the item pages
+        are fetched over the connections kept alive by the index fetch.
+
+        With a `deadline` (in seconds) enrichment gives up on the pages not
+        fetched in time, and those items are returned unenriched (their
+        `image_urls` left None), as are items whose page failed to load.
+        With `hedge_after` (in seconds) a page still loading after that long
+        is requested a second time, through another proxy if there's a pool,
+        and whichever response comes first is used.
         """
-        with ThreadPool(num_threads) as p:
-            map_enrich = partial(cls.enrich_item, proxies=proxies)
-            return p.map(map_enrich, stuff)
+        if deadline is None and hedge_after is None:
+            with ThreadPool(num_threads) as p:
+                map_enrich = partial(self._enrich_or_skip, proxies=proxies)
+                return p.map(map_enrich, stuff)
+
+        started: Dict[int, float] = {}
+
+        def fetch(index: int) -> ItemDetails:
+            started.setdefault(index, time.monotonic())
+            return self.get_details(stuff[index].url, proxies)
+
+        workers = ThreadPoolExecutor(num_threads)
+        hedges = ThreadPoolExecutor(num_threads)
+        owners: Dict[Future, int] = {workers.submit(fetch, index): index for index in range(len(stuff))}
+        hedged: Set[int] = set()
+        details: Dict[int, ItemDetails] = {}
+        end = time.monotonic() + deadline if deadline is not None else None
+        try:
+            while owners:
+                now = time.monotonic()
+                if end is not None and now >= end:
+                    break
+                wakeups = [end] if end is not None else []
+                if hedge_after is not None:
+                    loading = set(owners.values())
+                    for index, start in list(started.items()):
+                        if index in hedged or index not in loading:
+                            continue
+                        if now - start >= hedge_after:
+                            hedged.add(index)
+                            owners[hedges.submit(self.get_details, stuff[index].url, proxies)] = index
+                        else:
+                            wakeups.append(start + hedge_after)
+                    if len(started) < len(stuff):
+                        wakeups.append(now + hedge_after)  # pages queued behind the workers
+                timeout = max(0.0, min(wakeups) - now) if wakeups else None
+                done, _ = wait(list(owners), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future not in owners:  # both loads of a page finished, the other one won
+                        continue
+                    index = owners.pop(future)
+                    if future.exception() is not None:
+                        continue
+                    details[index] = future.result()
+                    for other, owner in list(owners.items()):
+                        if owner == index:
+                            other.cancel()
+                            del owners[other]
+        finally:
+            # pages still loading finish in the background, bounded by the session's timeout
+            for future in owners:
+                future.cancel()
+            workers.shutdown(wait=False)
+            hedges.shutdown(wait=False)
+
+        for index, item_details in details.items():
+            stuff[index].apply_details(item_details)
+        return stuff
+
+    async def aenrich_item(
+            self,
+            session: aiohttp.ClientSession,
+            item: Stuff,
+            proxies: Optional[dict] = None,
+            timeout: Optional[float] = None,
+    ) -> Stuff:
+        if self.cache is not None:
+            cached = self.cache.get(item.url)
+            if cached is not None:
+                item.apply_details(cached)
+                return item
+        proxy = (proxies or {}).get(urlsplit(item.url).scheme)
+        pooled_proxy = None
+        if not proxy and self.session.proxy_pool:
+            proxy = pooled_proxy = self.session.proxy_pool.choose()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.session.timeout)
+        scanner = DetailsScanner()
+        if self.session.limiter:
+            await self.session.limiter.aacquire(item.url)
+        start = time.monotonic()
+        try:
+            r = await session.get(item.url, proxy=proxy, timeout=client_timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.session.observe(item.url, pooled_proxy, None, time.monotonic() - start)
+            raise
+        self.session.observe(item.url, pooled_proxy, r.status, time.monotonic() - start, retry_after(r.headers))
+        async with r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                if scanner.feed(chunk):
+                    break
+            details = scanner.details()
+            if details is None:
+                details = await self.aparse_details(bytes(scanner.buffer) + await r.read())
+            elif (r.content_length or DRAIN_LIMIT + 1) <= DRAIN_LIMIT:
+                await r.read()  # keep the connection alive
+        if self.cache is not None:
+            self.cache.put(item.url, details)
+        item.apply_details(details)
+        return item
+
+    async def aenrich_inventory(
+            self,
+            stuff: List[Stuff],
+            proxies: Optional[dict] = None,
+            concurrency: int = 16,
+            timeout: Optional[float] = None,
+    ) -> AsyncIterator[Stuff]:
+        """
+        aenrich_inventory enriches the stuff with asyncio and yields each item
+        as soon as its page is parsed, rather than in the order given.
+
+        At most `concurrency` item pages are in flight at once. An item whose
+        page fails or takes longer than `timeout` seconds is yielded unenriched
+        (its `image_urls` remain None) so it doesn't hold up the rest.
+
+        async for item in search.aenrich_inventory(inventory):
+            ...
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded_enrich(session, item):
+            async with semaphore:
+                try:
+                    return await self.aenrich_item(session, item, proxies, timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    return item
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [asyncio.ensure_future(bounded_enrich(session, item)) for item in stuff]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            finally:
+                for task in tasks:
+                    task.cancel()
@@ -0,0 +1,191 @@
+from typing import Optional
+import threading
+import time
+
+import attr
+import requests
+from requests.adapters import HTTPAdapter
+
+from stuff.proxies import ProxyPool
+from stuff.throttle import RateLimiter, failed, retry_after
+
+
+DEFAULT_TIMEOUT = 10.0
+DRAIN_LIMIT = 64 * 1024
+
+
+@attr.s
+class PoolStats:
+    requests: int = attr.ib()
+    connections: int = attr.ib()
+
+    @property
+    def reused(self) -> int:
+        return self.requests - self.connections
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.reused / self.requests if self.requests else 0.0
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    CountingAdapter counts the requests it sends and the connections its
+    pools open (including connections dropped and reopened in place),
+    which is what tells whether keep-alive is working.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._pool_classes: dict = {}
+        super().__init__(*args, **kwargs)
+
+    def _count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def _counting(self, pool_cls):
+        if pool_cls not in self._pool_classes:
+            count_connection = self._count_connection
+
+            class CountingConnection(pool_cls.ConnectionCls):  # type: ignore
+                def connect(self):
+                    count_connection()
+                    return super().connect()
+
+            self._pool_classes[pool_cls] = type(
+                pool_cls.__name__, (pool_cls,), {"ConnectionCls": CountingConnection}
+            )
+        return self._pool_classes[pool_cls]
+
+    def _instrument(self, manager):
+        manager.pool_classes_by_scheme = {
+            scheme: self._counting(pool_cls)
+            for scheme, pool_cls in manager.pool_classes_by_scheme.items()
+        }
+        return manager
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self._instrument(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if proxy not in self.proxy_manager:
+            self._instrument(super().proxy_manager_for(proxy, **proxy_kwargs))
+        return self.proxy_manager[proxy]
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.requests += 1
+        return super().send(request, **kwargs)
+
+
+@attr.s
+class SessionPool:
+    """
+    SessionPool keeps alive the connections to craigslist so the index fetch
+    and the enrichment workers don't pay for a TCP+TLS handshake per page.
+
+    A single `HTTPAdapter` (and so a single urllib3 pool per host) is mounted
+    on one `requests.Session` per thread, which keeps cookie handling
+    thread local while every thread draws from the same connections.
+
+    Requests are paced per host by a `stuff.throttle.RateLimiter`,
+    which slows down when craigslist pushes back, and, unless given
+    explicit `proxies`, rotated across the `stuff.proxies.ProxyPool`.
+
+    examples:
+
+    pool = SessionPool.new(pool_maxsize=4, timeout=5)
+    pool.get("https://newyork.craigslist.org/search/zip")
+    pool.stats().reused
+    """
+    adapter: CountingAdapter = attr.ib()
+    timeout: Optional[float] = attr.ib(default=DEFAULT_TIMEOUT)
+    headers: dict = attr.ib(factory=dict)
+    limiter: Optional[RateLimiter] = attr.ib(default=None)
+    proxy_pool: Optional[ProxyPool] = attr.ib(default=None)
+    _local: threading.local = attr.ib(factory=threading.local, repr=False)
+
+    @classmethod
+    def new(
+            cls, pool_connections=10, pool_maxsize=8, block=True,
+            timeout=DEFAULT_TIMEOUT, max_retries=0, headers=None, rate=2.0,
+            proxy_pool=None,
+    ):
+        """
+        pool_connections is the number of hosts to keep pools for,
+        pool_maxsize is the number of connections kept alive per host and,
+        when `block` is set, the hard limit of concurrent requests per host.
+
+        rate is the initial number of requests per second per host,
+        None doesn't throttle requests at all.
+        """
+        adapter = CountingAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=block,
+            max_retries=max_retries,
+        )
+        limiter = RateLimiter(rate=rate) if rate else None
+        return cls(adapter, timeout, headers or {}, limiter, proxy_pool)
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        proxy = None
+        if self.proxy_pool and not kwargs.get("proxies"):
+            proxy = self.proxy_pool.choose()
+            if proxy:
+                kwargs["proxies"] = ProxyPool.as_requests(proxy)
+
+        if self.limiter:
+            self.limiter.acquire(url)
+        start = time.monotonic()
+        try:
+            r = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self.observe(url, proxy, None, time.monotonic() - start)
+            raise
+        self.observe(url, proxy, r.status_code, r.elapsed.total_seconds(), retry_after(r.headers))
+        return r
+
+    def observe(
+            self, url: str, proxy: Optional[str], status: Optional[int], elapsed: float,
+            retry_after: Optional[float] = None,
+    ):
+        """observe feeds the outcome of a request to the limiter and proxy pool"""
+        if self.limiter:
+            self.limiter.feedback(url, status, elapsed, retry_after)
+        if self.proxy_pool and proxy:
+            self.proxy_pool.report(proxy, not failed(status), elapsed)
+
+    def release(self, r: requests.Response, drain_limit: int = DRAIN_LIMIT):
+        """
+        release returns the connection of a partly read, streamed response
+        to the pool. Reading and discarding a small remainder is cheaper than
+        a new TCP+TLS handshake, a large (or unknown) one isn't, and then the
+        connection is closed instead.
+        """
+        length = r.headers.get("Content-Length")
+        if length is not None and length.isdigit() and int(length) <= drain_limit:
+            r.raw.drain_conn()
+        r.close()
+
+    def stats(self) -> PoolStats:
+        return PoolStats(requests=self.adapter.requests, connections=self.adapter.connections)
+
+    def close(self):
+        self.adapter.close()
@@ -0,0 +1,200 @@
+"""Serialize batches of `Stuff` to a compact binary snapshot.
+
+A snapshot stores the listings column by column, each column in the
+encoding which suits it, so that an inventory can be shipped between
+processes or hosts, or kept on disk, at a fraction of the size and
+cost of JSON:
+
+- times are microseconds since the epoch, prices and ids 64 bit integers
+- coordinates are pairs of doubles
+- urls, titles and image urls are length-prefixed utf-8,
+  and neighborhoods and cities, which repeat, are dictionary encoded
+
+    data = snapshot.dumps(inventory)
+    inventory = snapshot.loads(data)
+
+Coordinates come back as floats and cities as strings, as they're stored in the db.
+"""
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import struct
+import sys
+
+from stuff.core import NO_COORDINATES, Coordinates, Stuff
+
+
+MAGIC = b"STUF"
+VERSION = 1
+_HEADER = struct.Struct("<4sBI")
+_NONE = -1  # lengths, counts and indices of missing values
+_NO_INT = -2 ** 63  # times and ids of missing values
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# whether a listing has no coordinates, unknown ones or a location
+_NO_LOCATION, _UNKNOWN_LOCATION, _LOCATED = 0, 1, 2
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _pack(typecode: str, values) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return struct.pack("<I", len(column)) + column.tobytes()
+
+
+class _Reader:
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.position = 0
+
+    def take(self, size: int) -> memoryview:
+        if self.position + size > len(self.data):
+            raise SnapshotError("truncated snapshot")
+        chunk = self.data[self.position:self.position + size]
+        self.position += size
+        return chunk
+
+    def column(self, typecode: str) -> array:
+        length, = struct.unpack("<I", self.take(4))
+        column = array(typecode)
+        column.frombytes(self.take(length * column.itemsize))
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column
+
+    def strings(self) -> List[Optional[str]]:
+        lengths = self.column("i")
+        blob = bytes(self.take(sum(length for length in lengths if length != _NONE)))
+        strings: List[Optional[str]] = []
+        start = 0
+        for length in lengths:
+            if length == _NONE:
+                strings.append(None)
+                continue
+            strings.append(blob[start:start + length].decode("utf-8"))
+            start += length
+        return strings
+
+    def texts(self) -> List[str]:
+        """strings none of which may be missing"""
+        strings = self.strings()
+        texts = [string for string in strings if string is not None]
+        if len(texts) != len(strings):
+            raise SnapshotError("corrupt snapshot")
+        return texts
+
+    def dictionary(self) -> List[Optional[str]]:
+        values = self.strings()
+        indices = self.column("i")
+        if any(not _NONE <= index < len(values) for index in indices):
+            raise SnapshotError("corrupt snapshot")
+        return [values[index] if index != _NONE else None for index in indices]
+
+
+def _strings(values: Iterable[Optional[str]]) -> bytes:
+    lengths, encoded = [], []
+    for value in values:
+        if value is None:
+            lengths.append(_NONE)
+            continue
+        data = value.encode("utf-8")
+        lengths.append(len(data))
+        encoded.append(data)
+    return _pack("i", lengths) + b"".join(encoded)
+
+
+def _dictionary(values: Iterable[Optional[str]]) -> bytes:
+    codes: Dict[str, int] = {}
+    indices = [
+        _NONE if value is None else codes.setdefault(value, len(codes))
+        for value in values
+    ]
+    return _strings(list(codes)) + _pack("i", indices)
+
+
+def _location(coordinates: Optional[Coordinates]) -> Tuple[int, float, float]:
+    if coordinates is None:
+        return _NO_LOCATION, 0.0, 0.0
+    if coordinates.longitude is None or coordinates.latitude is None:
+        return _UNKNOWN_LOCATION, 0.0, 0.0
+    return _LOCATED, float(coordinates.longitude), float(coordinates.latitude)
+
+
+def _columns(stuff: List[Stuff]) -> List[bytes]:
+    locations = [_location(item.coordinates) for item in stuff]
+    image_urls = [item.image_urls for item in stuff]
+    return [
+        _strings(item.url for item in stuff),
+        _strings(item.title for item in stuff),
+        _pack("q", [
+            _NO_INT if item.time is None else (item.time - _EPOCH) // _MICROSECOND for item in stuff
+        ]),
+        _pack("q", [item.price for item in stuff]),
+        _dictionary(item.neighborhood for item in stuff),
+        _dictionary(getattr(item.city, "value", item.city) for item in stuff),
+        _pack("B", [location for location, _, _ in locations]),
+        _pack("d", [coordinate for _, longitude, latitude in locations for coordinate in (longitude, latitude)]),
+        _pack("i", [_NONE if urls is None else len(urls) for urls in image_urls]),
+        _strings(url for urls in image_urls if urls for url in urls),
+        _pack("B", [bool(item.delivered) for item in stuff]),
+        _pack("q", [_NO_INT if item.id is None else item.id for item in stuff]),
+    ]
+
+
+def dumps(stuff: Iterable[Stuff]) -> bytes:
+    stuff = list(stuff)
+    return b"".join([_HEADER.pack(MAGIC, VERSION, len(stuff))] + _columns(stuff))
+
+
+def loads(data: bytes) -> List[Stuff]:
+    reader = _Reader(data)
+    magic, version, count = _HEADER.unpack(reader.take(_HEADER.size))
+    if magic != MAGIC:
+        raise SnapshotError("not a stuff snapshot")
+    if version != VERSION:
+        raise SnapshotError("unsupported snapshot version {}".format(version))
+
+    urls = reader.texts()
+    titles = reader.texts()
+    times = reader.column("q")
+    prices = reader.column("q")
+    neighborhoods = reader.dictionary()
+    cities = reader.dictionary()
+    locations = reader.column("B")
+    coordinates = reader.column("d")
+    image_counts = reader.column("i")
+    image_urls = reader.texts()
+    delivered = reader.column("B")
+    ids = reader.column("q")
+    columns = [urls, titles, times, prices, neighborhoods, cities, locations, image_counts, delivered, ids]
+    if any(len(column) != count for column in columns) or len(coordinates) != 2 * count:
+        raise SnapshotError("corrupt snapshot")
+    if any(images < _NONE for images in image_counts) or (
+            len(image_urls) != sum(images for images in image_counts if images != _NONE)):
+        raise SnapshotError("corrupt snapshot")
+
+    next_image_url = iter(image_urls)
+    stuff = []
+    for i in range(count):
+        if locations[i] == _LOCATED:
+            location: Optional[Coordinates] = Coordinates(coordinates[2 * i], coordinates[2 * i + 1])
+        else:
+            location = NO_COORDINATES if locations[i] == _UNKNOWN_LOCATION else None
+        images = image_counts[i]
+        stuff.append(Stuff(
+            url=urls[i],
+            title=titles[i],
+            time=None if times[i] == _NO_INT else _EPOCH + times[i] * _MICROSECOND,
+            price=prices[i],
+            neighborhood=neighborhoods[i],
+            city=cities[i],
+            image_urls=None if images == _NONE else [next(next_image_url) for _ in range(images)],
+            coordinates=location,
+            delivered=bool(delivered[i]),
+            id=None if ids[i] == _NO_INT else ids[i],
+        ))
+    return stuff
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+import requests
+import responses
+
+from stuff.cache import DetailsCache
+from stuff.parsers import ItemDetails
+from stuff.search import Search
+from stuff.tests.utils import FakeClock, _data
+
+
+URL = "https://newyork.craigslist.org/brk/zip/d/brooklyn-free-insulation/6977996917.html"
+DETAILS = ItemDetails(['https://images.craigslist.org/00L0L_5e2M7zY0JYR_600x450.jpg'], '-73.957000', '40.646700')
+
+
+class DetailsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DetailsCache.new(ttl=100, max_entries=2, clock=self.clock)
+
+    def test_put_and_get(self):
+        self.assertIsNone(self.cache.get(URL))
+        self.cache.put(URL, DETAILS)
+        self.assertEqual(DETAILS, self.cache.get(URL))
+        self.cache.put(URL, ItemDetails([], None, None))
+        self.assertEqual(ItemDetails([], None, None), self.cache.get(URL))
+        self.assertEqual(1, len(self.cache))
+
+    def test_entries_expire(self):
+        self.cache.put(URL, DETAILS)
+        self.clock.now = 101
+        self.assertIsNone(self.cache.get(URL))
+        self.assertEqual(0, len(self.cache))
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.put("a", DETAILS)
+        self.clock.now = 1
+        self.cache.put("b", DETAILS)
+        self.clock.now = 2
+        self.cache.get("a")
+        self.clock.now = 3
+        self.cache.put("c", DETAILS)
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(DETAILS, self.cache.get("a"))
+        self.assertEqual(DETAILS, self.cache.get("c"))
+
+    def test_persists_on_disk(self):
+        path = os.path.join(tempfile.mkdtemp(), "details.db")
+        cache = DetailsCache.new(path)
+        cache.put(URL, DETAILS)
+        cache.close()
+        cache = DetailsCache.new(path)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(DETAILS, cache.get(URL))
+
+    @responses.activate
+    def test_search_get_details_reads_through_cache(self):
+        responses.add(responses.GET, URL, body="blocked", status=403)
+        responses.add(responses.GET, URL, body=_data("craigslist_zip_item_page.html"))
+        search = Search(cache=self.cache)
+
+        with self.assertRaises(requests.HTTPError):
+            search.get_details(URL)
+        self.assertIsNone(self.cache.get(URL), "failed pages aren't cached")
+        self.assertEqual(DETAILS, search.get_details(URL))
+        self.assertEqual(DETAILS, search.get_details(URL))
+        self.assertEqual(2, len(responses.calls))
@@ -0,0 +1,302 @@
+import re
+import unittest
+from unittest.mock import patch
+import requests
+import responses
+
+from stuff.cache import DetailsCache
+from stuff.client import StatefulClient
+from stuff.constants import Area, Category, Region
+from stuff.core import Stuff
+from stuff.parsers import ItemDetails
+from stuff.proxies import ProxyPool
+from stuff.search import Search
+from stuff.tests.utils import _data
+
+
+NEW_URL = "https://newyork.craigslist.org/brk/zip/d/free-boxes-and-packing-supplies/7000000000.html"
+
+
+def _page_with_new_listing(title="Solid oak writing desk") -> str:
+    new_list_item = _data("zip_list_item.html").replace(
+        "https://newyork.craigslist.org/brk/zip/d/free-boxes-and-packing-supplies/6978063787.html",
+        NEW_URL,
+    ).replace("FREE BOXES and PACKING SUPPLIES", title)
+    return _data("craigslist_zip.html").replace(
+        '<ul class="rows">', '<ul class="rows">' + new_list_item, 1,
+    )
+
+
+class StatefulClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.search = Search()
+        self.client = StatefulClient.new(search=self.search, log_level="WARNING")
+        self.client.setup()
+
+    @responses.activate
+    def test_populate_db_only_parses_new_listings(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, self.search.build_url(), body=_page_with_new_listing())
+
+        self.client.populate_db(set_delivered=True)
+        self.assertEqual(120, len(self.client.db_client.get_all_stuff()))
+
+        with patch.object(Stuff, "from_row", wraps=Stuff.from_row) as from_row:
+            self.client.populate_db()
+        self.assertEqual(1, from_row.call_count)
+        undelivered = self.client.db_client.get_all_undelivered_stuff()
+        self.assertEqual([NEW_URL], [stuff.url for stuff in undelivered])
+
+    @responses.activate
+    def test_new_makes_a_fresh_default_search(self):
+        responses.add(responses.GET, Search().build_url(), body=_data("craigslist_zip.html"))
+        for _ in range(2):
+            client = StatefulClient.new(log_level="WARNING")
+            client.setup()
+            client.populate_db(set_delivered=True)
+            self.assertEqual(120, len(client.db_client.get_all_stuff()))
+            self.assertEqual(0, client.searches[0].unchanged_count)
+
+    def test_new_settings_stay_with_their_client(self):
+        configured = StatefulClient.new(
+            log_level="WARNING", proxy_pool=ProxyPool.new(["http://1.1.1.1:3129"]),
+            details_cache=DetailsCache.new(),
+        )
+        self.assertIsNotNone(configured.searches[0].session.proxy_pool)
+        default = StatefulClient.new(log_level="WARNING")
+        self.assertIsNone(default.searches[0].session.proxy_pool)
+        self.assertIsNone(default.searches[0].cache)
+        self.assertIsNone(default.searches[0].processes)
+
+    def test_query_keeps_the_search_settings(self):
+        client = StatefulClient.new(
+            log_level="WARNING", proxy_pool=ProxyPool.new(["http://1.1.1.1:3129"]),
+            details_cache=DetailsCache.new(),
+        )
+        before = client.searches[0]
+        client.query(Region.new_york_city, Area.brooklyn, Category.furniture, "desk", None)
+
+        search, = client.searches
+        self.assertEqual("desk", search.query)
+        self.assertIs(before.session, search.session)
+        self.assertIsNotNone(search.session.proxy_pool)
+        self.assertIs(before.cache, search.cache)
+
+    @responses.activate
+    def test_populate_db_refetches_a_page_whose_listings_failed_to_store(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        db = self.client.db_client
+        with patch.object(db, "upsert_many", side_effect=RuntimeError("db is gone")):
+            with self.assertRaises(RuntimeError):
+                self.client.populate_db(set_delivered=True)
+        self.assertEqual({}, self.search.validators)
+
+        self.client.populate_db(set_delivered=True)
+        self.assertEqual(120, len(db.get_all_stuff()))
+        self.assertEqual(0, self.search.unchanged_count)
+
+    @responses.activate
+    def test_populate_db_checks_seen_urls_in_bulk(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, self.search.build_url(), body=_page_with_new_listing())
+        db = self.client.db_client
+        with patch.object(db, "get_stuff_by_url") as get_stuff_by_url, \
+                patch.object(db, "existing_urls", wraps=db.existing_urls) as existing_urls:
+            self.client.populate_db(set_delivered=True)
+            self.assertEqual(1, existing_urls.call_count)
+
+            self.client.warm_seen()
+            self.assertEqual(120, len(self.client.seen_urls))
+            self.client.populate_db()
+            self.assertEqual(1, existing_urls.call_count)
+            get_stuff_by_url.assert_not_called()
+
+        self.assertIn(NEW_URL, self.client.seen_urls)
+        self.assertEqual([NEW_URL], [stuff.url for stuff in db.get_all_undelivered_stuff()])
+
+    @responses.activate
+    def test_populate_db_skips_stuff_stored_meanwhile(self):
+        responses.add(responses.GET, self.search.build_url(), body=_page_with_new_listing())
+        self.client.reposts = None
+        stored = Search().parse_inventory(_page_with_new_listing().encode())[:3]
+        self.client.db_client.insert_many(stored)
+
+        # as if another client sharing the db stored them after they were checked
+        with patch.object(self.client, "known_urls", return_value=set()):
+            self.client.populate_db()
+
+        undelivered = self.client.db_client.get_all_undelivered_stuff()
+        self.assertEqual(121, len(undelivered))
+        self.assertEqual(121, len({stuff.url for stuff in undelivered}))
+
+    @responses.activate
+    def test_deliver_undelivered_marks_delivered_in_one_update(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        self.client.populate_db()
+        db = self.client.db_client
+        with patch.object(db, "update_stuff") as update_stuff, \
+                patch.object(db, "mark_delivered", wraps=db.mark_delivered) as mark_delivered:
+            self.assertEqual(120, len(self.client.deliver_undelivered()))
+        update_stuff.assert_not_called()
+        self.assertEqual(1, mark_delivered.call_count)
+        self.assertEqual([], db.get_all_undelivered_stuff())
+
+    @responses.activate
+    def test_populate_db_retries_items_missing_the_enrichment_deadline(self):
+        responses.add(responses.GET, self.search.build_url(), body=_page_with_new_listing())
+        details = ItemDetails(["https://images.craigslist.org/a.jpg"], "-73.9", "40.6")
+        missed = [NEW_URL]
+
+        def get_details(url, proxies=None):
+            if url in missed:
+                raise requests.Timeout()
+            return details
+
+        with patch.object(self.search, "get_details", side_effect=get_details):
+            self.client.populate_db(enrich_inventory=True)
+            pending = self.client.db_client.get_unenriched_stuff()
+            self.assertEqual([NEW_URL], [item.url for item in pending])
+            self.assertIsNone(pending[0].image_urls)
+            self.client.deliver(pending[0])
+
+            missed.clear()
+            self.client.populate_db(enrich_inventory=True)
+
+        self.assertEqual([], self.client.db_client.get_unenriched_stuff())
+        stored = self.client.db_client.get_stuff_by_url(NEW_URL)
+        self.assertEqual(details.image_urls, stored.image_urls)
+        self.assertTrue(stored.delivered)
+
+    @responses.activate
+    def test_populate_db_enriches_backlog_within_budget_newest_first(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        details = ItemDetails([], None, None)
+        self.client.populate_db(set_delivered=True)
+        stored = self.client.db_client.get_all_stuff()
+
+        with patch.object(self.search, "get_details", return_value=details) as get_details:
+            self.client.populate_db(enrich_inventory=True, limit_enrichment=50)
+            self.client.populate_db(enrich_inventory=True, limit_enrichment=50)
+        self.assertEqual(
+            {stuff.url for stuff in stored[:100]},
+            {call.args[0] for call in get_details.call_args_list},
+        )
+        self.assertEqual(
+            [stuff.url for stuff in stored[100:]],
+            [stuff.url for stuff in self.client.db_client.get_unenriched_stuff()],
+        )
+
+    @responses.activate
+    def test_enrich_backlog_keeps_throttled_items(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, re.compile(r".*\.html$"), body="slow down", status=429)
+        self.search.session.limiter = None  # not waiting out the backoff
+        self.client.populate_db(set_delivered=True)
+
+        self.client.populate_db(enrich_inventory=True, limit_enrichment=3)
+        self.assertEqual(120, len(self.client.db_client.get_unenriched_stuff()))
+        self.assertEqual(0, self.client.enrich_backlog(budget=3))
+
+    @responses.activate
+    def test_deliver_undelivered_enriches_only_stuff_being_delivered(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, self.search.build_url(), body=_page_with_new_listing())
+        details = ItemDetails(["https://images.craigslist.org/a.jpg"], "-73.9", "40.6")
+
+        with patch.object(self.search, "get_details", return_value=details) as get_details:
+            self.client.populate_db(set_delivered=True)
+            self.assertEqual([], self.client.deliver_undelivered(with_media=True))
+            self.assertEqual(1, len(responses.calls))
+
+            self.client.populate_db()
+            with patch.object(self.client.emitter, "emit", wraps=self.client.emitter.emit) as emit:
+                self.assertEqual(1, len(self.client.deliver_undelivered(with_media=True)))
+            self.assertEqual([NEW_URL], [call.args[0] for call in get_details.call_args_list])
+            self.assertEqual(details.image_urls, emit.call_args.args[0].image_urls)
+
+        stored = self.client.db_client.get_stuff_by_url(NEW_URL)
+        self.assertTrue(stored.delivered)
+        self.assertEqual(details.image_urls, stored.image_urls)
+        self.assertEqual(120, len(self.client.db_client.get_unenriched_stuff()))
+
+    @responses.activate
+    def test_populate_db_skips_reposts(self):
+        responses.add(responses.GET, self.search.build_url(), body=_data("craigslist_zip.html"))
+        responses.add(
+            responses.GET, self.search.build_url(),
+            body=_page_with_new_listing(title="Free Boxes & Packing Supplies!!"),
+        )
+        self.client.populate_db(set_delivered=True)
+        self.client.populate_db()
+
+        self.assertEqual([], self.client.db_client.get_all_undelivered_stuff())
+        self.assertEqual([], self.client.db_client.get_stuff_by_url(NEW_URL).image_urls)
+        self.assertEqual(0, len(self.client.deliver_undelivered(with_media=True)))
+
+    def test_warm_reposts_from_db(self):
+        stuff = Search().parse_inventory(_data("craigslist_zip.html").encode())
+        for item in stuff:
+            self.client.db_client.insert_stuff(item)
+        self.client.warm_reposts()
+        self.assertEqual(120, len(self.client.reposts))
+
+
+class StatefulClientSearchesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.searches = [
+            Search(area=Area.brooklyn, category=Category.free),
+            Search(area=Area.queens, category=Category.free),
+            Search(area=Area.queens, category=Category.furniture),
+        ]
+        self.client = StatefulClient.new(searches=self.searches, log_level="WARNING")
+        self.client.setup()
+
+    def test_new_shares_connection_pool(self):
+        self.assertIs(self.searches[0].session, self.searches[1].session)
+        self.assertIs(self.searches[0].session, self.searches[2].session)
+
+    @responses.activate
+    def test_populate_db_deduplicates_across_searches(self):
+        responses.add(responses.GET, self.searches[0].build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, self.searches[1].build_url(), body=_page_with_new_listing())
+        responses.add(responses.GET, self.searches[2].build_url(), body="<html></html>")
+
+        self.client.populate_db()
+        self.assertEqual(3, len(responses.calls))
+        stored = self.client.db_client.get_all_stuff()
+        self.assertEqual(121, len(stored))
+        self.assertEqual(121, len({stuff.url for stuff in stored}))
+
+    @responses.activate
+    def test_populate_db_carries_on_when_a_search_fails(self):
+        responses.add(responses.GET, self.searches[0].build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, self.searches[1].build_url(), body=requests.ConnectionError("refused"))
+        responses.add(responses.GET, self.searches[2].build_url(), body=requests.Timeout("too slow"))
+
+        self.client.populate_db()
+        self.assertEqual(120, len(self.client.db_client.get_all_stuff()))
+
+    @responses.activate
+    def test_populate_db_skips_when_no_search_changed(self):
+        for search in self.searches:
+            responses.add(responses.GET, search.build_url(), body=_data("craigslist_zip.html"))
+        self.client.populate_db(set_delivered=True)
+
+        with patch.object(Stuff, "from_row", wraps=Stuff.from_row) as from_row:
+            self.client.populate_db()
+        self.assertEqual(0, from_row.call_count)
+        self.assertEqual([1, 1, 1], [search.unchanged_count for search in self.searches])
+
+    @responses.activate
+    def test_populate_db_parses_on_process_pool(self):
+        client = StatefulClient.new(searches=self.searches, log_level="WARNING", parse_processes=2)
+        client.setup()
+        self.addCleanup(self.searches[0].processes.shutdown)
+        self.assertIs(self.searches[0].processes, self.searches[2].processes)
+        responses.add(responses.GET, self.searches[0].build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, self.searches[1].build_url(), body=_page_with_new_listing())
+        responses.add(responses.GET, self.searches[2].build_url(), body="<html></html>")
+
+        client.populate_db()
+        stored = client.db_client.get_all_stuff()
+        self.assertEqual(121, len({stuff.url for stuff in stored}))
@@ -1,5 +1,14 @@
-import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from unittest.mock import patch
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
 
 from stuff.db import DBClient, DBStuff
 from stuff.core import Stuff, Coordinates
@@ -74,3 +83,252 @@ class DBClientTestCase(unittest.TestCase):
 
         updated_stuff = self.client.get_stuff_by_id(stuff.id)
         self.assertEqual(updated_stuff.delivered, True)
+
+    def test_client_update_details_takes_stuff_off_the_backlog(self):
+        for day in (19, 20, 21):
+            self.client.insert_stuff(
+                Stuff(
+                    title="My Title", url="https://somewhere.com/{}".format(day),
+                    time=datetime(2019, 4, day), price=0,
+                    neighborhood="Clinton Hill", city="newyork",
+                    coordinates=None, image_urls=None,
+                )
+            )
+        pending = self.client.get_unenriched_stuff(limit=2)
+        self.assertEqual(["https://somewhere.com/21", "https://somewhere.com/20"], [s.url for s in pending])
+        self.assertIsNone(pending[0].image_urls)
+
+        pending[0].image_urls = ["https://somewhere.com/item/1"]
+        pending[0].coordinates = Coordinates(10.0, 20.0)
+        pending[1].image_urls = []
+        self.client.update_details(pending)
+
+        self.assertEqual(["https://somewhere.com/19"], [s.url for s in self.client.get_unenriched_stuff()])
+        enriched = self.client.get_stuff_by_url("https://somewhere.com/21")
+        self.assertEqual(["https://somewhere.com/item/1"], enriched.image_urls)
+        self.assertEqual(Coordinates(10.0, 20.0), enriched.coordinates)
+        self.assertEqual([], self.client.get_stuff_by_url("https://somewhere.com/20").image_urls)
+
+    def test_client_create_db_adds_enriched_column_to_old_dbs(self):
+        with self.client._engine.begin() as connection:
+            connection.execute("DROP TABLE stuff")
+            connection.execute(
+                "CREATE TABLE stuff (id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, url VARCHAR NOT NULL,"
+                " price INTEGER, time DATETIME, neighborhood VARCHAR, city VARCHAR,"
+                " longititude FLOAT, latitude FLOAT, image_url VARCHAR, delivered BOOLEAN)"
+            )
+            connection.execute(
+                "INSERT INTO stuff (title, url, price, city, image_url) VALUES"
+                " ('old', 'https://somewhere.com/old', 0, 'newyork', 'https://somewhere.com/item/1'),"
+                " ('bare', 'https://somewhere.com/bare', 0, 'newyork', NULL)"
+            )
+        self.client.create_db()
+
+        self.assertEqual(["https://somewhere.com/bare"], [s.url for s in self.client.get_unenriched_stuff()])
+
+    def test_client_insert_many(self):
+        stuffs = [
+            Stuff(
+                title="My Title {}".format(i), url="https://somewhere.com/{}".format(i),
+                time=datetime(2019, 4, 20, i % 24), price=i, neighborhood="Clinton Hill", city="newyork",
+                coordinates=Coordinates(10.0, 20.0) if i % 2 else None,
+                image_urls=["https://somewhere.com/item/{}".format(i)] if i % 3 else None,
+                delivered=i % 5 == 0,
+            )
+            for i in range(1200)
+        ]
+        self.client.insert_stuff(stuffs.pop())
+        ids = self.client.insert_many(stuffs)
+
+        self.assertEqual(1199, len(set(ids)))
+        for i in [0, 1, 3, 500, 1198]:
+            stored = self.client.get_stuff_by_id(ids[i])
+            self.assertEqual(stuffs[i].url, stored.url)
+            self.assertEqual(stuffs[i].delivered, stored.delivered)
+            self.assertEqual(stuffs[i].image_urls, stored.image_urls)
+            self.assertEqual(stuffs[i].coordinates, stored.coordinates if i % 2 else None)
+        self.assertEqual([], self.client.insert_many([]))
+
+    def test_client_insert_many_is_one_transaction(self):
+        stuffs = [
+            Stuff(title="My Title", url=url, time=datetime(2019, 4, 20), price=0,
+                  neighborhood="Clinton Hill", city="newyork")
+            for url in ["https://somewhere.com/1", "https://somewhere.com/2", "https://somewhere.com/1"]
+        ]
+        with self.assertRaises(IntegrityError):
+            self.client.insert_many(stuffs)
+        self.assertEqual([], self.client.get_all_stuff())
+
+    def test_client_existing_urls(self):
+        stuffs = [
+            Stuff(title="My Title", url="https://somewhere.com/{}".format(i), time=datetime(2019, 4, 20),
+                  price=0, neighborhood="Clinton Hill", city="newyork")
+            for i in range(0, 1500, 2)
+        ]
+        self.client.insert_many(stuffs)
+        urls = ["https://somewhere.com/{}".format(i) for i in range(1500)]
+
+        self.assertEqual({stuff.url for stuff in stuffs}, self.client.existing_urls(urls))
+        self.assertEqual(set(), self.client.existing_urls([]))
+        self.assertEqual({stuff.url for stuff in stuffs}, self.client.get_urls())
+
+    def _stuffs(self, indices):
+        return [
+            Stuff(title="My Title", url="https://somewhere.com/{}".format(i), time=datetime(2019, 4, 20, 10, 30),
+                  price=i, neighborhood="Clinton Hill", city="newyork")
+            for i in indices
+        ]
+
+    def test_client_upsert_many_returns_only_inserted(self):
+        self.client.insert_many(self._stuffs(range(0, 300, 3)))
+        inserted = self.client.upsert_many(self._stuffs(list(range(300)) + [1, 2]))
+
+        self.assertEqual([i for i in range(300) if i % 3], [stuff.price for stuff in inserted])
+        for stuff in inserted[:5]:
+            self.assertEqual(stuff.url, self.client.get_stuff_by_id(stuff.id).url)
+        self.assertEqual(300, len(self.client.get_urls()))
+        self.assertEqual(datetime(2019, 4, 20, 10, 30), self.client.get_stuff_by_url("https://somewhere.com/1").time)
+        self.assertEqual([], self.client.upsert_many(self._stuffs(range(300))))
+
+    def test_client_upsert_many_without_returning(self):
+        self.client.insert_many(self._stuffs([0, 2]))
+        with patch("stuff.db.SQLITE_RETURNING", False):
+            inserted = self.client.upsert_many(self._stuffs([0, 1, 2, 3, 3]))
+        self.assertEqual([1, 3], [stuff.price for stuff in inserted])
+        self.assertEqual(4, len(self.client.get_urls()))
+
+    def test_client_postgresql_upsert(self):
+        rows = [DBStuff.from_api_model(stuff).to_row() for stuff in self._stuffs([0, 1])]
+        statement = str(DBClient._postgresql_upsert(rows).compile(dialect=postgresql.dialect()))
+        self.assertIn("ON CONFLICT (url) DO NOTHING RETURNING stuff.url, stuff.id", statement)
+        self.assertIn("%(url_m1)s", statement)
+
+    def test_client_upsert_many_concurrently(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = "sqlite:///" + os.path.join(directory, "stuff.db")
+            clients = [DBClient.new(path) for _ in range(4)]
+            clients[0].create_db()
+            with ThreadPoolExecutor(4) as pool:
+                inserted = list(pool.map(
+                    lambda client: client.upsert_many(self._stuffs(range(200))), clients,
+                ))
+            self.assertEqual(200, sum(len(stuffs) for stuffs in inserted))
+            self.assertEqual(200, len(clients[0].get_urls()))
+
+    def _count_statements(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+        event.listen(self.client._engine, "before_cursor_execute", listener)
+        self.addCleanup(event.remove, self.client._engine, "before_cursor_execute", listener)
+        return statements
+
+    def test_client_mark_delivered_is_one_statement(self):
+        inserted = self.client.upsert_many(self._stuffs(range(200)))
+        statements = self._count_statements()
+
+        self.assertEqual(200, self.client.mark_delivered([stuff.id for stuff in inserted]))
+        self.assertEqual(1, len([statement for statement in statements if statement.startswith("UPDATE")]))
+        self.assertEqual([], self.client.get_all_undelivered_stuff())
+
+    def test_client_update_fields(self):
+        inserted = self.client.upsert_many(self._stuffs(range(600)))
+        ids = [stuff.id for stuff in inserted[:550]]
+
+        self.assertEqual(550, self.client.update_fields(ids, longitude=10.0, latitude=20.0, city="newyork"))
+        self.assertEqual(Coordinates(10.0, 20.0), self.client.get_stuff_by_id(ids[-1]).coordinates)
+        self.assertIsNone(self.client.get_stuff_by_id(inserted[-1].id).coordinates.longitude)
+        self.assertEqual(0, self.client.update_fields([], delivered=True))
+        with self.assertRaises(TypeError):
+            self.client.update_fields(ids, colour="blue")
+
+    def _query_plans(self, read):
+        statements = []
+        def listener(conn, cursor, statement, parameters, *args):
+            statements.append((statement, parameters))
+        event.listen(self.client._engine, "before_cursor_execute", listener)
+        try:
+            read()
+        finally:
+            event.remove(self.client._engine, "before_cursor_execute", listener)
+        with self.client._engine.connect() as connection:
+            return [
+                " ".join(row[-1] for row in connection.execute("EXPLAIN QUERY PLAN " + statement, parameters))
+                for statement, parameters in statements
+            ]
+
+    def test_client_reads_use_indexes(self):
+        self.client.insert_many(self._stuffs(range(50)))
+        reads = {
+            "ix_stuff_city_time": lambda: self.client.get_some_stuff("newyork", 10, offset=10),
+            "ix_stuff_delivered_time": lambda: self.client.get_all_undelivered_stuff(limit=10),
+            "ix_stuff_enriched_time": lambda: self.client.get_unenriched_stuff(limit=10),
+            "ix_stuff_time": lambda: self.client.get_all_stuff(limit=10),
+        }
+        for index, read in reads.items():
+            with self.subTest(index=index):
+                plan, = self._query_plans(read)
+                self.assertIn("USING INDEX " + index, plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_client_reads_page_in_sql(self):
+        stuffs = self._stuffs(range(30))
+        for i, stuff in enumerate(stuffs):
+            stuff.time = datetime(2019, 4, 20, 10, i)
+        self.client.insert_many(stuffs)
+        statements = self._count_statements()
+
+        page = self.client.get_some_stuff("newyork", 10, offset=5)
+        self.assertEqual(list(range(24, 14, -1)), [stuff.price for stuff in page])
+        self.assertEqual([29, 28], [stuff.price for stuff in self.client.get_all_undelivered_stuff(limit=2)])
+        self.assertEqual([1, 0], [stuff.price for stuff in self.client.get_all_stuff(limit=5, offset=28)])
+        self.assertTrue(all("LIMIT" in statement for statement in statements))
+
+    def test_client_create_db_adds_indexes_to_old_dbs(self):
+        with self.client._engine.begin() as connection:
+            for index in ["ix_stuff_delivered_time", "ix_stuff_city_time", "ix_stuff_enriched_time", "ix_stuff_time"]:
+                connection.execute("DROP INDEX {}".format(index))
+        self.client.create_db()
+
+        plan, = self._query_plans(lambda: self.client.get_all_undelivered_stuff(limit=10))
+        self.assertIn("USING INDEX ix_stuff_delivered_time", plan)
+
+
+class DBProfileTestCase(unittest.TestCase):
+    def _pragma(self, client, name):
+        with client._engine.connect() as connection:
+            return connection.execute("PRAGMA {}".format(name)).scalar()
+
+    def test_fast_profile_sets_pragmas_and_pools_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = DBClient.new("sqlite:///" + os.path.join(directory, "stuff.db") + "?profile=fast")
+            client.create_db()
+
+            self.assertIsInstance(client._engine.pool, QueuePool)
+            self.assertEqual("wal", self._pragma(client, "journal_mode"))
+            self.assertEqual(1, self._pragma(client, "synchronous"))
+            self.assertEqual(5000, self._pragma(client, "busy_timeout"))
+            client.insert_many([Stuff("https://somewhere.com/a", "a", datetime.now(), 0, "Bay Ridge", "newyork")])
+            self.assertEqual("a", client.get_stuff_by_url("https://somewhere.com/a").title)
+            client._engine.dispose()
+
+    def test_fast_profile_in_memory(self):
+        client = DBClient.new("sqlite:///:memory:?profile=fast")
+        client.create_db()
+
+        self.assertEqual(1, self._pragma(client, "synchronous"))
+        self.assertEqual("memory", self._pragma(client, "journal_mode"))
+
+    def test_default_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = DBClient.new("sqlite:///" + os.path.join(directory, "stuff.db"))
+            client.create_db()
+
+            self.assertEqual("delete", self._pragma(client, "journal_mode"))
+            self.assertEqual(2, self._pragma(client, "synchronous"))
+            client._engine.dispose()
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            DBClient.new("sqlite:///:memory:?profile=reckless")
+        with self.assertRaises(ValueError):
+            DBClient.new("postgresql://localhost/stuff?profile=fast")
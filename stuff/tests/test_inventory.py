@@ -0,0 +1,70 @@
+from datetime import datetime
+import unittest
+
+import attr
+import numpy as np
+
+from stuff.core import NO_COORDINATES, Coordinates, Stuff
+from stuff.db import DBClient
+from stuff.inventory import Inventory
+from stuff.search import Search
+from stuff.tests.utils import _raw_data
+
+
+class InventoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stuff = [
+            Stuff(url="https://somewhere.com/1", title="chair", time=datetime(2019, 9, 13, 15, 24),
+                  price=0, neighborhood="Bay Ridge", city="newyork",
+                  coordinates=Coordinates("-73.957000", "40.646700"), image_urls=["https://somewhere.com/1.jpg"]),
+            Stuff(url="https://somewhere.com/2", title="table", time=datetime(2019, 9, 12, 10, 0),
+                  price=40, neighborhood=None, city="newyork", id=7, delivered=True),
+            Stuff(url="https://somewhere.com/3", title="rug", time=datetime(2019, 9, 14, 8, 30),
+                  price=15, neighborhood="Greenpoint", city="newyork",
+                  coordinates=Coordinates(-73.95, 40.73), image_urls=[]),
+        ]
+        self.inventory = Inventory.from_stuff(self.stuff)
+
+    def test_roundtrip(self):
+        self.assertEqual(3, len(self.inventory))
+        roundtrip = self.inventory.to_stuff()
+        self.assertEqual(self.stuff[1], roundtrip[1])
+        self.assertEqual(Coordinates(-73.957, 40.6467), roundtrip[0].coordinates)
+        self.assertEqual(self.stuff[2], roundtrip[2])
+        self.assertEqual([stuff.url for stuff in self.stuff], [stuff.url for stuff in self.inventory])
+
+    def test_roundtrip_db_rows(self):
+        db = DBClient.new("sqlite://")
+        db.create_db()
+        db.insert_many(self.stuff)
+        stored = db.get_all_stuff()
+
+        roundtrip = Inventory.from_stuff(stored).to_stuff()
+        self.assertEqual([attr.evolve(stuff, city=stuff.city.value) for stuff in stored], roundtrip)
+        self.assertIs(NO_COORDINATES, roundtrip[-1].coordinates)
+
+    def test_filters(self):
+        self.assertEqual([True, False, True], self.inventory.prices_between(high=20).tolist())
+        self.assertEqual([False, True, True], self.inventory.prices_between(10, 40).tolist())
+        self.assertEqual(
+            [True, False, False],
+            self.inventory.since(datetime(2019, 9, 13), datetime(2019, 9, 14)).tolist(),
+        )
+        self.assertEqual(
+            [False, False, True],
+            self.inventory.within(south=40.7, west=-74.0, north=40.8, east=-73.9).tolist(),
+        )
+        cheap_recent = self.inventory[self.inventory.prices_between(high=20) & self.inventory.since(datetime(2019, 9, 14))]
+        self.assertEqual(["rug"], cheap_recent.titles.tolist())
+
+    def test_sort_by(self):
+        self.assertEqual(["rug", "chair", "table"], self.inventory.sort_by("time", descending=True).titles.tolist())
+        self.assertEqual(["chair", "rug", "table"], self.inventory.sort_by("price").titles.tolist())
+        self.assertEqual(["table", "chair", "rug"], self.inventory.sort_by("id", descending=True).titles.tolist())
+
+    def test_from_search_results(self):
+        stuff = Search().parse_inventory(_raw_data("craigslist_zip.html"))
+        inventory = Inventory.from_stuff(stuff)
+        self.assertEqual(120, len(inventory))
+        self.assertTrue(np.isnan(inventory.longitudes).all())
+        self.assertEqual(stuff, inventory.to_stuff())
@@ -0,0 +1,129 @@
+from concurrent.futures import ProcessPoolExecutor
+import unittest
+
+from stuff.parsers import (
+    PARSERS, DetailsScanner, ItemDetails, SoupParser, get_parser, parse_item_details, parse_rows, scan_details,
+)
+from stuff.tests.utils import _raw_data
+
+
+def _installed_parsers():
+    parsers = []
+    for name in PARSERS:
+        try:
+            parsers.append(get_parser(name))
+        except ImportError:
+            pass
+    return parsers
+
+
+class ParserParityTestCase(unittest.TestCase):
+    """every backend must extract exactly what the BeautifulSoup one does"""
+
+    def setUp(self):
+        self.reference = SoupParser()
+        self.parsers = _installed_parsers()
+
+    def test_rows_parity(self):
+        for filename in ["craigslist_zip.html", "zip_list.html", "zip_list_item.html"]:
+            content = _raw_data(filename)
+            expected = self.reference.rows(content)
+            for parser in self.parsers:
+                with self.subTest(parser=parser.name, filename=filename):
+                    self.assertEqual(expected, parser.rows(content))
+                    self.assertEqual(
+                        [row.url for row in expected],
+                        [parser.item_url(list_item) for list_item in parser.list_items(content)],
+                    )
+
+    def test_rows_are_decoded_as_utf8(self):
+        rows = self.reference.rows(_raw_data("craigslist_zip.html"))
+        self.assertIn("Large navy blue area rug 10’ x 14’", [row.title for row in rows])
+
+    def test_details_parity(self):
+        for filename in ["craigslist_zip_item_page.html", "craigslist_zip_item_page_no_image.html"]:
+            content = _raw_data(filename)
+            expected = self.reference.parse_details(content)
+            for parser in self.parsers:
+                with self.subTest(parser=parser.name, filename=filename):
+                    self.assertEqual(expected, parser.parse_details(content))
+
+    def test_details(self):
+        details = self.reference.parse_details(_raw_data("craigslist_zip_item_page.html"))
+        self.assertEqual(
+            details,
+            ItemDetails(
+                image_urls=['https://images.craigslist.org/00L0L_5e2M7zY0JYR_600x450.jpg'],
+                longitude='-73.957000',
+                latitude='40.646700',
+            )
+        )
+
+    def test_no_results_list(self):
+        for parser in self.parsers:
+            with self.subTest(parser=parser.name):
+                self.assertEqual([], parser.rows(b"<html><body><p>nothing</p></body></html>"))
+
+
+class DetailsScannerTestCase(unittest.TestCase):
+    def test_scan_details_parity(self):
+        for filename in ["craigslist_zip_item_page.html", "craigslist_zip_item_page_no_image.html"]:
+            content = _raw_data(filename)
+            with self.subTest(filename=filename):
+                self.assertEqual(SoupParser().parse_details(content), scan_details(content))
+
+    def test_scanner_stops_after_map(self):
+        content = _raw_data("craigslist_zip_item_page.html")
+        scanner = DetailsScanner()
+        chunks = [content[i:i + 512] for i in range(0, len(content), 512)]
+        for read, chunk in enumerate(chunks, 1):
+            if scanner.feed(chunk):
+                break
+        self.assertLess(read, len(chunks))
+        self.assertEqual(SoupParser().parse_details(content), scanner.details())
+
+    def test_scanner_without_posting_layout(self):
+        content = b'<html><body><img src="https://images.craigslist.org/a.jpg"></body></html>'
+        self.assertIsNone(scan_details(content))
+
+    def test_scanner_map_without_coordinates(self):
+        content = b'<html><body><div id="map" class="viewposting"></div></body></html>'
+        self.assertIsNone(scan_details(content))
+
+    def test_scanner_ignores_comments_and_scripts(self):
+        content = (
+            b'<!-- <img src="commented.jpg"> -->'
+            b'<script>document.write(\'<img src="scripted.jpg">\');</script>'
+            b'<img src="https://images.craigslist.org/a.jpg?x=1&amp;y=2">'
+            b'<div data-latitude="1.5" id="map" data-longitude=\'2.5\'></div>'
+        )
+        self.assertEqual(
+            ItemDetails(["https://images.craigslist.org/a.jpg?x=1&y=2"], "2.5", "1.5"),
+            scan_details(content),
+        )
+
+    def test_scanner_only_stops_on_the_map_div(self):
+        gallery = b'<img src="a.jpg"><div id="map" data-latitude="1.5" data-longitude="2.5"></div>'
+        for decoy in [
+            b'<a id="map-link" href="#map">map</a>',
+            b'<span data-id="map"></span>',
+            b'<script>var id = "map";</script>',
+            b'<!-- <div id="map"> -->',
+        ]:
+            content = b"<html><body>" + decoy + gallery + b"</body></html>"
+            with self.subTest(decoy=decoy):
+                scanner = DetailsScanner()
+                for i in range(0, len(content), 7):  # tags straddle chunks
+                    if scanner.feed(content[i:i + 7]):
+                        break
+                self.assertEqual(ItemDetails(["a.jpg"], "2.5", "1.5"), scanner.details())
+
+class ProcessPoolParsingTestCase(unittest.TestCase):
+    def test_parse_on_process_pool(self):
+        results_page = _raw_data("craigslist_zip.html")
+        item_page = _raw_data("craigslist_zip_item_page.html")
+        with ProcessPoolExecutor(2) as processes:
+            rows = processes.submit(parse_rows, results_page, SoupParser.name).result()
+            details = processes.submit(parse_item_details, item_page).result()
+        self.assertEqual(SoupParser().rows(results_page), rows)
+        self.assertEqual(SoupParser().parse_details(item_page), details)
@@ -0,0 +1,71 @@
+import unittest
+
+import requests
+import responses
+
+from stuff.proxies import ProxyPool
+from stuff.session import SessionPool
+from stuff.tests.utils import FakeClock
+
+
+PROXIES = ["http://1.1.1.1:3129", "http://2.2.2.2:3129", "http://3.3.3.3:3129"]
+URL = "https://newyork.craigslist.org/search/zip"
+
+
+class ProxyPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = ProxyPool.new(PROXIES, clock=self.clock)
+
+    def test_choose_rotates_across_proxies(self):
+        chosen = {self.pool.choose() for _ in range(50)}
+        self.assertEqual(set(PROXIES), chosen)
+
+    def test_choose_prefers_fast_proxies(self):
+        for proxy, latency in zip(PROXIES, [0.1, 1.0, 2.0]):
+            self.pool.report(proxy, ok=True, elapsed=latency)
+        chosen = [self.pool.choose() for _ in range(300)]
+        self.assertGreater(chosen.count(PROXIES[0]), chosen.count(PROXIES[1]))
+        self.assertNotIn(PROXIES[2], chosen)  # always loses to whichever it's paired with
+
+    def test_failing_proxy_is_ejected_then_returns(self):
+        for proxy in PROXIES[1:]:
+            self.pool.report(proxy, ok=True, elapsed=0.5)
+        for _ in range(3):
+            self.pool.report(PROXIES[0], ok=False, elapsed=0.1)
+        self.assertNotIn(PROXIES[0], {self.pool.choose() for _ in range(50)})
+
+        self.clock.now = 301
+        self.assertIn(PROXIES[0], {self.pool.choose() for _ in range(50)})
+        self.pool.report(PROXIES[0], ok=False, elapsed=0.1)
+        self.pool.report(PROXIES[0], ok=False, elapsed=0.1)
+        self.assertNotIn(PROXIES[0], {self.pool.choose() for _ in range(50)})
+
+    def test_choose_when_all_ejected(self):
+        for proxy in PROXIES:
+            self.clock.now += 1
+            for _ in range(3):
+                self.pool.report(proxy, ok=False, elapsed=0.1)
+        self.assertEqual(PROXIES[0], self.pool.choose())
+
+    def test_choose_without_proxies(self):
+        self.assertIsNone(ProxyPool.new([]).choose())
+
+    @responses.activate
+    def test_session_pool_uses_and_scores_proxy_pool(self):
+        session = SessionPool.new(rate=None, proxy_pool=ProxyPool.new(PROXIES[:1]))
+        responses.add(responses.GET, URL, status=403)
+        responses.add(responses.GET, URL, body=requests.exceptions.ProxyError())
+        responses.add(responses.GET, URL, status=200)
+
+        session.get(URL)
+        with self.assertRaises(requests.exceptions.ProxyError):
+            session.get(URL)
+        session.get(URL, proxies={"https": "http://9.9.9.9:3129"})
+
+        proxies = [call.request.req_kwargs["proxies"] for call in responses.calls]
+        self.assertEqual(ProxyPool.as_requests(PROXIES[0]), proxies[0])
+        self.assertEqual({"https": "http://9.9.9.9:3129"}, proxies[2])
+        health = session.proxy_pool.proxies[PROXIES[0]]
+        self.assertEqual(2, health.requests)
+        self.assertEqual(1.0, health.error_rate)
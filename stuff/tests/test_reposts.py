@@ -0,0 +1,49 @@
+from datetime import datetime
+import unittest
+
+from stuff.core import Stuff
+from stuff.reposts import RepostIndex, distance, fingerprint
+from stuff.search import Search
+from stuff.tests.utils import _raw_data
+
+
+def _stuff(url, title, neighborhood="Bay Ridge", price=0):
+    return Stuff(url=url, title=title, time=datetime(2019, 9, 13), price=price, neighborhood=neighborhood, city="newyork")
+
+
+class RepostIndexTestCase(unittest.TestCase):
+    def test_fingerprints_of_reworded_titles_are_close(self):
+        original = fingerprint(_stuff("1", "Ikea Malm dresser, 6 drawers, white"))
+        self.assertLessEqual(distance(original, fingerprint(_stuff("2", "FREE: IKEA malm dresser 6 drawers white"))), 3)
+        self.assertGreater(distance(original, fingerprint(_stuff("5", "Ikea Billy bookcase, white"))), 3)
+
+    def test_check_finds_reposts(self):
+        index = RepostIndex()
+        index.add(_stuff("1", "Ikea Malm dresser, 6 drawers, white"))
+        self.assertEqual("1", index.check(_stuff("2", "Ikea Malm dresser - 6 drawers - white!")))
+        self.assertIsNone(index.check(_stuff("1", "Ikea Malm dresser, 6 drawers, white")))
+        self.assertIsNone(index.check(_stuff("3", "Ikea Billy bookcase, white")))
+        self.assertIsNone(index.check(_stuff("4", "Ikea Malm dresser, 6 drawers, white", "Astoria")))
+        self.assertIsNone(index.check(_stuff("5", "Ikea Malm dresser, 6 drawers, white", price=20)))
+
+    def test_titles_of_stop_words_are_never_reposts(self):
+        index = RepostIndex()
+        index.add(_stuff("1", "FREE!!"))
+        self.assertEqual(0, len(index))
+        for url, title in [("2", "Curb alert"), ("3", "Must go"), ("4", "free"), ("5", "FREE!!")]:
+            self.assertIsNone(index.check(_stuff(url, title)), title)
+
+    def test_no_reposts_among_distinct_listings(self):
+        index = RepostIndex()
+        for stuff in Search().parse_inventory(_raw_data("craigslist_zip.html")):
+            self.assertIsNone(index.check(stuff), stuff.title)
+            index.add(stuff)
+
+    def test_evicts_oldest(self):
+        index = RepostIndex(max_entries=2)
+        for url, title in [("1", "oak desk"), ("2", "blue rug"), ("3", "floor lamp")]:
+            index.add(_stuff(url, title))
+        self.assertEqual(2, len(index))
+        self.assertIsNone(index.check(_stuff("4", "oak desk")))
+        self.assertEqual("2", index.check(_stuff("5", "blue rug")))
+        self.assertTrue(all(url in index.entries for band in index.bands for urls in band.values() for url in urls))
@@ -1,8 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import asyncio
+import threading
+import time
 import unittest
+from unittest.mock import patch
+import requests
 import responses
+from aresponses import ResponsesMockServer
 
 from stuff.core import Stuff, Coordinates
+from stuff.parsers import ItemDetails
 from stuff.search import Search, Proximinity
 from stuff.constants import Area, Category
 from stuff.tests.utils import _data
@@ -35,6 +43,90 @@ class SearchTestCase(unittest.TestCase):
             'https://newyork.craigslist.org/search/brk/zip?search_distance=1&postal=11238',
         )
 
+    def test_search_build_url_with_offset(self):
+        c = Search(category=Category.furniture, query="rug")
+        self.assertEqual(c.build_url(offset=0), 'https://newyork.craigslist.org/search/hsh?query=rug')
+        self.assertEqual(c.build_url(offset=120), 'https://newyork.craigslist.org/search/hsh?query=rug&s=120')
+
+    @responses.activate
+    def test_search_iter_inventory_fetches_pages_lazily(self):
+        search = Search()
+        last_page = '<ul class="rows">{}</ul>'.format(_data("zip_list_item.html"))
+        responses.add(responses.GET, search.build_url(), body=_data("craigslist_zip.html"))
+        responses.add(responses.GET, search.build_url(offset=120), body=last_page)
+
+        inventory = search.iter_inventory()
+        first = next(inventory)
+        self.assertEqual('2 Round Blue Outdoor Side Tables', first.title)
+        self.assertEqual(1, len(responses.calls))
+
+        rest = list(inventory)
+        self.assertEqual(120, len(rest))
+        self.assertEqual("FREE BOXES and PACKING SUPPLIES", rest[-1].title)
+        self.assertEqual(2, len(responses.calls))
+
+    @responses.activate
+    def test_search_iter_inventory_stop_at(self):
+        search = Search()
+        responses.add(responses.GET, search.build_url(), body=_data("craigslist_zip.html"))
+        seen_url = search.get_inventory()[3].url
+
+        inventory = list(search.iter_inventory(stop_at=lambda stuff: stuff.url == seen_url))
+        self.assertEqual(3, len(inventory))
+        self.assertEqual(2, len(responses.calls))
+
+    @responses.activate
+    def test_search_get_inventory_stops_at_run_of_seen_urls(self):
+        search = Search()
+        responses.add(responses.GET, search.build_url(), body=_data("craigslist_zip.html"))
+        urls = [stuff.url for stuff in search.get_inventory()]
+        seen = set(urls[2:])
+
+        with patch.object(Stuff, "from_row", wraps=Stuff.from_row) as from_row:
+            inventory = search.get_inventory(seen=seen.__contains__, known_run=3)
+        self.assertEqual(urls[:2], [stuff.url for stuff in inventory])
+        self.assertEqual(2, from_row.call_count)
+
+    @responses.activate
+    def test_search_get_inventory_skips_seen_urls_within_run(self):
+        search = Search()
+        responses.add(responses.GET, search.build_url(), body=_data("craigslist_zip.html"))
+        urls = [stuff.url for stuff in search.get_inventory()]
+        seen = {urls[1], urls[2], urls[10]}
+
+        inventory = search.get_inventory(seen=seen.__contains__, known_run=3)
+        self.assertEqual(117, len(inventory))
+        self.assertEqual(urls[3], inventory[1].url)
+
+    def test_search_parse_inventory_with_bulk_known_urls(self):
+        content = _data("craigslist_zip.html").encode()
+        urls = [stuff.url for stuff in Search().parse_inventory(content)]
+        calls = []
+
+        def known_urls(page_urls):
+            calls.append(page_urls)
+            return {urls[1], urls[2], urls[10]}
+
+        inventory = Search().parse_inventory(content, known_run=3, known_urls=known_urls)
+        self.assertEqual([urls], calls)
+        self.assertEqual(117, len(inventory))
+        self.assertEqual(urls[3], inventory[1].url)
+
+    @responses.activate
+    def test_search_get_details_falls_back_to_parser(self):
+        url = "https://newyork.craigslist.org/brk/zip/d/brooklyn-free-insulation/6977996917.html"
+        responses.add(responses.GET, url, body=_data("craigslist_zip_item_page.html"))
+        responses.add(responses.GET, url, body='<html><body><img src="https://images.craigslist.org/a.jpg"></body></html>')
+        search = Search()
+
+        details = search.get_details(url)
+        self.assertEqual(['https://images.craigslist.org/00L0L_5e2M7zY0JYR_600x450.jpg'], details.image_urls)
+        self.assertEqual(('-73.957000', '40.646700'), (details.longitude, details.latitude))
+
+        details = search.get_details(url)
+        self.assertEqual(['https://images.craigslist.org/a.jpg'], details.image_urls)
+        self.assertIsNone(details.longitude)
+
     @responses.activate
     def test_search_get_text(self):
         search = Search()
@@ -63,6 +155,33 @@ class SearchTestCase(unittest.TestCase):
         self.assertEqual(expected, inventory[0])
         self.assertEqual(120, len(inventory))
 
+    @responses.activate
+    def test_search_poll_inventory_sends_conditional_request(self):
+        search = Search()
+        responses.add(
+            responses.GET, search.build_url(), body=_data("craigslist_zip.html"),
+            headers={"ETag": '"abc"', "Last-Modified": "Sun, 15 Sep 2019 12:15:00 GMT"},
+        )
+        responses.add(responses.GET, search.build_url(), status=304)
+        self.assertEqual(120, len(search.poll_inventory()))
+        self.assertIsNone(search.poll_inventory())
+        self.assertEqual(1, search.unchanged_count)
+        conditional = responses.calls[1].request.headers
+        self.assertEqual('"abc"', conditional["If-None-Match"])
+        self.assertEqual("Sun, 15 Sep 2019 12:15:00 GMT", conditional["If-Modified-Since"])
+
+    @responses.activate
+    def test_search_poll_inventory_skips_unchanged_listings(self):
+        search = Search()
+        page = _data("craigslist_zip.html")
+        responses.add(responses.GET, search.build_url(), body=page)
+        responses.add(responses.GET, search.build_url(), body=page.replace("</title>", "</title><!-- token -->"))
+        responses.add(responses.GET, search.build_url(), body=page.replace("Side Tables", "Side Chairs"))
+        self.assertEqual(120, len(search.poll_inventory()))
+        self.assertIsNone(search.poll_inventory())
+        self.assertEqual("2 Round Blue Outdoor Side Chairs", search.poll_inventory()[0].title)
+        self.assertEqual(1, search.unchanged_count)
+
     @responses.activate
     def test_search_enrich_inventory_can_run_enrich_async_in_sync_thread(self):
         inventory = [
@@ -103,7 +222,7 @@ class SearchTestCase(unittest.TestCase):
             body=_data("craigslist_zip_item_page.html"),
         )
 
-        inventory = Search.enrich_inventory(inventory)
+        inventory = Search().enrich_inventory(inventory)
         self.assertTrue(any([inv.coordinates for inv in inventory]))
         self.assertTrue(any([inv.image_urls for inv in inventory]))
         self.assertEqual(4, len(inventory))
@@ -119,3 +238,135 @@ class SearchTestCase(unittest.TestCase):
             coordinates=Coordinates(longitude='-73.957000', latitude='40.646700')
         )
         self.assertEqual(inventory[0], expected)
+
+
+class SearchProcessesTestCase(unittest.TestCase):
+    def test_parse_inventory_on_process_pool(self):
+        content = _data("craigslist_zip.html").encode()
+        urls = [stuff.url for stuff in Search().parse_inventory(content)]
+        known = set(urls[:2] + urls[5:8])
+        with ProcessPoolExecutor(1) as processes:
+            search = Search(processes=processes)
+            self.assertEqual(Search().parse_inventory(content), search.parse_inventory(content))
+            self.assertEqual(urls[2:5], [
+                stuff.url for stuff in search.parse_inventory(content, seen=known.__contains__, known_run=3)
+            ])
+
+
+class SearchDeadlineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.inventory = [
+            Stuff(url='https://newyork.craigslist.org/brk/zip/d/brooklyn-free-insulation/6977996917.html',
+                  title='FREE Insulation', time=datetime(2019, 9, 13, 15, 24), price=0, city="newyork",
+                  neighborhood='Bay Ridge, Brooklyn', image_urls=None, coordinates=None),
+            Stuff(url='https://newyork.craigslist.org/brk/zip/d/brooklyn-10-foot-round-pool/6977959276.html',
+                  title='10 foot round pool', time=datetime(2019, 9, 13, 14, 38), price=0, neighborhood='bklyn',
+                  image_urls=None, coordinates=None, city="newyork"),
+        ]
+        self.details = ItemDetails(["https://images.craigslist.org/a.jpg"], "-73.9", "40.6")
+
+    def test_enrich_inventory_returns_items_missing_the_deadline_unenriched(self):
+        release = threading.Event()
+
+        def get_details(url, proxies=None):
+            if "insulation" in url:
+                release.wait(5)
+            return self.details
+
+        search = Search()
+        with patch.object(search, "get_details", side_effect=get_details):
+            start = time.monotonic()
+            enriched = search.enrich_inventory(self.inventory, deadline=0.2)
+            self.assertLess(time.monotonic() - start, 1)
+        release.set()
+
+        self.assertEqual(['FREE Insulation', '10 foot round pool'], [item.title for item in enriched])
+        self.assertIsNone(enriched[0].image_urls)
+        self.assertEqual(self.details.image_urls, enriched[1].image_urls)
+
+    def test_enrich_inventory_returns_failed_items_unenriched(self):
+        def get_details(url, proxies=None):
+            if "insulation" in url:
+                raise requests.ConnectionError("reset")
+            return self.details
+
+        search = Search()
+        with patch.object(search, "get_details", side_effect=get_details):
+            enriched = search.enrich_inventory(self.inventory, deadline=1)
+
+        self.assertIsNone(enriched[0].image_urls)
+        self.assertIsNotNone(enriched[1].coordinates)
+
+    def test_enrich_inventory_hedges_slow_pages(self):
+        calls: list = []
+        release = threading.Event()
+
+        def get_details(url, proxies=None):
+            calls.append(url)
+            if calls.count(url) == 1 and "insulation" in url:
+                release.wait(5)  # the first request hangs, the hedge doesn't
+            return self.details
+
+        search = Search()
+        with patch.object(search, "get_details", side_effect=get_details):
+            start = time.monotonic()
+            enriched = search.enrich_inventory(self.inventory, deadline=2, hedge_after=0.1)
+            self.assertLess(time.monotonic() - start, 1)
+        release.set()
+
+        self.assertEqual(2, calls.count(self.inventory[0].url))
+        self.assertEqual(1, calls.count(self.inventory[1].url))
+        self.assertTrue(all(item.image_urls for item in enriched))
+
+
+class AsyncSearchTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.inventory = [
+            Stuff(url='https://newyork.craigslist.org/brk/zip/d/brooklyn-free-insulation/6977996917.html',
+                  title='FREE Insulation', time=datetime(2019, 9, 13, 15, 24), price=0, city="newyork",
+                  neighborhood='Bay Ridge, Brooklyn', image_urls=None, coordinates=None),
+            Stuff(url='https://newyork.craigslist.org/brk/zip/d/brooklyn-10-foot-round-pool/6977959276.html',
+                  title='10 foot round pool', time=datetime(2019, 9, 13, 14, 38), price=0, neighborhood='bklyn',
+                  image_urls=None, coordinates=None, city="newyork"),
+        ]
+
+    async def test_search_aenrich_inventory(self):
+        async with ResponsesMockServer() as arsps:
+            arsps.add("newyork.craigslist.org", "/brk/zip/d/brooklyn-free-insulation/6977996917.html",
+                      "GET", _data("craigslist_zip_item_page.html"))
+            arsps.add("newyork.craigslist.org", "/brk/zip/d/brooklyn-10-foot-round-pool/6977959276.html",
+                      "GET", _data("craigslist_zip_item_page.html"))
+            enriched = [item async for item in Search().aenrich_inventory(self.inventory, concurrency=2)]
+
+        self.assertEqual(2, len(enriched))
+        for item in enriched:
+            self.assertEqual(item.image_urls, ['https://images.craigslist.org/00L0L_5e2M7zY0JYR_600x450.jpg'])
+            self.assertEqual(item.coordinates, Coordinates(longitude='-73.957000', latitude='40.646700'))
+
+    async def test_search_aenrich_inventory_yields_slow_items_last_and_unenriched(self):
+        async def slow_page(request):
+            await asyncio.sleep(1)
+            return arsps.Response(body=_data("craigslist_zip_item_page.html"))
+
+        async with ResponsesMockServer() as arsps:
+            arsps.add("newyork.craigslist.org", "/brk/zip/d/brooklyn-free-insulation/6977996917.html",
+                      "GET", slow_page)
+            arsps.add("newyork.craigslist.org", "/brk/zip/d/brooklyn-10-foot-round-pool/6977959276.html",
+                      "GET", _data("craigslist_zip_item_page.html"))
+            enriched = [item async for item in Search().aenrich_inventory(self.inventory, timeout=0.2)]
+
+        self.assertEqual(enriched[0].title, '10 foot round pool')
+        self.assertIsNotNone(enriched[0].coordinates)
+        self.assertEqual(enriched[1].title, 'FREE Insulation')
+        self.assertIsNone(enriched[1].image_urls)
+
+    async def test_search_aenrich_inventory_leaves_error_pages_unenriched(self):
+        async with ResponsesMockServer() as arsps:
+            arsps.add("newyork.craigslist.org", "/brk/zip/d/brooklyn-free-insulation/6977996917.html",
+                      "GET", arsps.Response(status=429, body="slow down"))
+            arsps.add("newyork.craigslist.org", "/brk/zip/d/brooklyn-10-foot-round-pool/6977959276.html",
+                      "GET", _data("craigslist_zip_item_page.html"))
+            enriched = {item.title: item async for item in Search().aenrich_inventory(self.inventory)}
+
+        self.assertIsNone(enriched["FREE Insulation"].image_urls)
+        self.assertIsNotNone(enriched["10 foot round pool"].image_urls)
@@ -0,0 +1,84 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.pool import ThreadPool
+import threading
+import unittest
+
+from stuff.session import SessionPool
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"<html>" + b" " * (100 * 1024 if self.path == "/large" else 1024) + b"</html>"
+        self.send_response(429 if self.path == "/blocked" else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_session_pool_reuses_connections(self):
+        pool = SessionPool.new(timeout=5)
+        for _ in range(5):
+            self.assertEqual(pool.get(self.url).status_code, 200)
+        stats = pool.stats()
+        self.assertEqual(stats.requests, 5)
+        self.assertEqual(stats.connections, 1)
+        self.assertEqual(stats.reused, 4)
+        pool.close()
+
+    def test_session_pool_release_drains_small_responses(self):
+        pool = SessionPool.new(timeout=5)
+        for _ in range(3):
+            r = pool.get(self.url, stream=True)
+            next(r.iter_content(16))
+            pool.release(r)
+        self.assertEqual(pool.stats().connections, 1)
+
+    def test_session_pool_release_closes_large_responses(self):
+        pool = SessionPool.new(timeout=5)
+        for _ in range(2):
+            r = pool.get(self.url + "large", stream=True)
+            next(r.iter_content(16))
+            pool.release(r)
+        self.assertEqual(pool.stats().connections, 2)
+
+    def test_session_pool_throttles_host_on_blocked_response(self):
+        pool = SessionPool.new(timeout=5, rate=4)
+        pool.get(self.url)
+        self.assertGreater(pool.limiter.host_rate(self.url), 4)
+        pool.get(self.url + "blocked")
+        self.assertLess(pool.limiter.host_rate(self.url), 4)
+
+    def test_session_pool_limits_connections_per_host_across_threads(self):
+        pool = SessionPool.new(pool_maxsize=2, timeout=5, rate=None)
+        with ThreadPool(6) as p:
+            codes = p.map(lambda _: pool.get(self.url).status_code, range(30))
+        self.assertEqual(set(codes), {200})
+        stats = pool.stats()
+        self.assertEqual(stats.requests, 30)
+        self.assertLessEqual(stats.connections, 2)
+        pool.close()
+
+    def test_session_pool_sessions_are_thread_local_and_share_adapter(self):
+        pool = SessionPool.new()
+        with ThreadPool(2) as p:
+            sessions = p.map(lambda _: pool.session, range(2))
+        self.assertIs(pool.session, pool.session)
+        self.assertIsNot(pool.session, sessions[0])
+        for session in sessions + [pool.session]:
+            self.assertIs(session.get_adapter(self.url), pool.adapter)
@@ -0,0 +1,49 @@
+from datetime import datetime
+import unittest
+
+from stuff import snapshot
+from stuff.core import NO_COORDINATES, Coordinates, Stuff
+from stuff.search import Search
+from stuff.tests.utils import _raw_data
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def test_roundtrip(self):
+        stuff = [
+            Stuff(url="https://somewhere.com/1", title="chaise longue – très bien", time=datetime(2019, 9, 13, 15, 24),
+                  price=0, neighborhood="Bay Ridge", city="newyork", id=3, delivered=True,
+                  coordinates=Coordinates(-73.957, 40.6467), image_urls=["https://somewhere.com/1.jpg", "b.jpg"]),
+            Stuff(url="https://somewhere.com/2", title="", time=datetime(2019, 9, 12, 10, 0, 0, 250),
+                  price=40, neighborhood=None, city="newyork", coordinates=NO_COORDINATES, image_urls=[]),
+            Stuff(url="https://somewhere.com/3", title="rug", time=datetime(2019, 9, 14, 8, 30),
+                  price=15, neighborhood="Bay Ridge", city="newyork"),
+        ]
+        self.assertEqual(stuff, snapshot.loads(snapshot.dumps(stuff)))
+        self.assertEqual([], snapshot.loads(snapshot.dumps([])))
+
+    def test_search_results_roundtrip_smaller_than_json(self):
+        stuff = Search().parse_inventory(_raw_data("craigslist_zip.html"))
+        data = snapshot.dumps(stuff)
+        self.assertEqual(stuff, snapshot.loads(data))
+        self.assertLess(len(data), len(_raw_data("craigslist_zip.html")) / 10)
+
+    def test_rejects_other_data(self):
+        data = snapshot.dumps([Stuff(url="u", title="t", time=None, price=1, neighborhood=None, city="newyork")])
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.loads(b"{}" + data)
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.loads(data[:-4])
+
+    def test_rejects_corrupt_columns(self):
+        stuff = [
+            Stuff(url="https://somewhere.com/{}".format(i), title="rug", time=datetime(2019, 9, 14, 8, i),
+                  price=i, neighborhood="Bay Ridge", city="newyork", id=i, coordinates=Coordinates(-73.9, 40.6),
+                  image_urls=["https://somewhere.com/{}.jpg".format(i)])
+            for i in range(3)
+        ]
+        header = snapshot._HEADER.pack(snapshot.MAGIC, snapshot.VERSION, 2)
+        two, three = snapshot._columns(stuff[:2]), snapshot._columns(stuff)
+        self.assertEqual(stuff[:2], snapshot.loads(header + b"".join(two)))
+        for i in range(len(two)):
+            with self.subTest(column=i), self.assertRaises(snapshot.SnapshotError):
+                snapshot.loads(header + b"".join(two[:i] + [three[i]] + two[i + 1:]))
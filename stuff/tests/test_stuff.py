@@ -1,9 +1,12 @@
 from datetime import datetime
+import sys
 import unittest
 
+import attr
 from bs4 import BeautifulSoup
 
-from stuff.core import Stuff, Coordinates
+from stuff.core import NO_COORDINATES, Stuff, Coordinates
+from stuff.parsers import ListingRow
 from stuff.tests.utils import _data
 
 
@@ -43,3 +46,37 @@ class StuffTestCase(unittest.TestCase):
             city="newyork",
         )
         self.assertEqual(stuff, expected)
+
+    def test_stuff_is_compact(self):
+        stuff = Stuff.from_row(
+            ListingRow("https://somewhere.com/", "My Title", "2019-09-13 16:31", "$5", "".join(["Clinton", " Hill"])),
+            "".join(["new", "york"]),
+        )
+        self.assertFalse(hasattr(stuff, "__dict__"))
+        self.assertIs(stuff.neighborhood, sys.intern("Clinton Hill"))
+        self.assertIs(stuff.city, "newyork")
+
+    def test_coordinates_are_frozen_and_empty_ones_shared(self):
+        self.assertIs(Coordinates.of(None, None), Coordinates.of(None, None))
+        self.assertEqual(Coordinates(10.0, 20.0), Coordinates.of(10.0, 20.0))
+        with self.assertRaises(attr.exceptions.FrozenInstanceError):
+            Coordinates(10.0, 20.0).latitude = 0
+
+    def test_api_dict_roundtrip(self):
+        stuff = Stuff(
+            url="https://somewhere.com/", title="My Title", time=datetime(2019, 9, 13, 16, 31),
+            price=0, neighborhood="Clinton Hill", city="newyork", id=1,
+            coordinates=Coordinates(10.0, 20.0), image_urls=["https://somewhere.com/1.jpg"],
+        )
+        d = stuff.to_api_dict()
+        self.assertEqual((10.0, 20.0, "https://somewhere.com/1.jpg"), (d["longitude"], d["latitude"], d["image_url"]))
+        self.assertEqual(stuff, Stuff.from_api_dict(d))
+
+        stuff = Stuff(url="https://somewhere.com/", title="My Title", time=datetime(2019, 9, 13, 16, 31),
+                      price=0, neighborhood=None, city="newyork")
+        self.assertIsNone(stuff.to_api_dict()["longitude"])
+        self.assertEqual(stuff, Stuff.from_api_dict(stuff.to_api_dict()))
+
+        stuff.image_urls, stuff.coordinates = [], NO_COORDINATES  # enriched, without images or a location
+        self.assertEqual(stuff, Stuff.from_api_dict(stuff.to_api_dict()))
+        self.assertIs(NO_COORDINATES, Stuff.from_api_dict(stuff.to_api_dict()).coordinates)
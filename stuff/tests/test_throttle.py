@@ -0,0 +1,59 @@
+import unittest
+
+from stuff.throttle import RateLimiter, retry_after
+from stuff.tests.utils import FakeClock
+
+
+URL = "https://newyork.craigslist.org/search/zip"
+OTHER_HOST_URL = "https://boston.craigslist.org/search/zip"
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(rate=2, burst=2, max_rate=3, recovery=0.5, clock=self.clock)
+
+    def test_reserve_allows_burst_then_paces(self):
+        self.assertEqual([0.0, 0.0, 0.5, 1.0], [self.limiter.reserve(URL) for _ in range(4)])
+        self.clock.now = 1.0
+        self.assertEqual(0.5, self.limiter.reserve(URL))
+
+    def test_hosts_are_limited_separately(self):
+        for _ in range(3):
+            self.limiter.reserve(URL)
+        self.assertEqual(0.0, self.limiter.reserve(OTHER_HOST_URL))
+
+    def test_backs_off_on_blocked_status(self):
+        self.limiter.feedback(URL, 429, elapsed=0.1)
+        self.assertEqual(1.0, self.limiter.host_rate(URL))
+        self.assertEqual(1.0, self.limiter.reserve(URL))  # the bucket was emptied
+        self.assertEqual(2.0, self.limiter.host_rate(OTHER_HOST_URL))
+
+    def test_backs_off_once_per_interval(self):
+        for status in [503, 403, None]:
+            self.limiter.feedback(URL, status, elapsed=0.1)
+        self.assertEqual(1.0, self.limiter.host_rate(URL))
+        self.clock.now = 1.0
+        self.limiter.feedback(URL, 500, elapsed=0.1)
+        self.assertEqual(0.5, self.limiter.host_rate(URL))
+
+    def test_backs_off_on_slow_response(self):
+        self.limiter.feedback(URL, 200, elapsed=10)
+        self.assertEqual(1.0, self.limiter.host_rate(URL))
+
+    def test_recovers_gradually(self):
+        self.limiter.feedback(URL, 429, elapsed=0.1)
+        self.limiter.feedback(URL, 200, elapsed=0.1)
+        self.assertEqual(1.5, self.limiter.host_rate(URL))
+        for _ in range(5):
+            self.limiter.feedback(URL, 200, elapsed=0.1)
+        self.assertEqual(3.0, self.limiter.host_rate(URL))
+
+    def test_holds_for_retry_after(self):
+        self.limiter.feedback(URL, 429, elapsed=0.1, retry_after=30)
+        self.assertAlmostEqual(31.0, self.limiter.reserve(URL))
+
+    def test_retry_after(self):
+        self.assertEqual(120.0, retry_after({"Retry-After": "120"}))
+        self.assertIsNone(retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}))
+        self.assertIsNone(retry_after({}))
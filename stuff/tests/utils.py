@@ -7,3 +7,19 @@ def _data(filename: str) -> str:
     )
     with open(file_path, "r") as file:
         return file.read()
+
+
+def _raw_data(filename: str) -> bytes:
+    file_path = os.path.join(
+        os.path.dirname(__file__), "data", filename
+    )
+    with open(file_path, "rb") as file:
+        return file.read()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
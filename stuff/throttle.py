@@ -0,0 +1,123 @@
+from typing import Callable, Dict, Optional
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+import attr
+
+
+BLOCKED_STATUSES = {403, 429}
+
+
+def failed(status: Optional[int]) -> bool:
+    """whether a response status (None for no response) means craigslist pushed back"""
+    return status is None or status in BLOCKED_STATUSES or status >= 500
+
+
+@attr.s
+class TokenBucket:
+    rate: float = attr.ib()
+    capacity: float = attr.ib()
+    tokens: float = attr.ib()
+    updated: float = attr.ib()
+    decreased: float = attr.ib(default=float("-inf"))
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """
+        take a token and return how long to wait before using it, tokens can go
+        negative so that waiting requests queue up rather than race each other.
+        """
+        self.refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+@attr.s
+class RateLimiter:
+    """
+    RateLimiter is a token bucket per host which adapts its rate to how
+    craigslist responds (additive increase, multiplicative decrease):
+
+    - a 403, 429 or 5xx, a connection error or a response slower than
+      `slow_seconds` cuts the host's rate by `backoff` (at most once per
+      `decrease_interval`, as one overload fails every request in flight)
+      and empties its bucket, or holds it for the response's Retry-After
+    - every other response raises the rate by `recovery` requests per second,
+      up to `max_rate`
+
+    examples:
+
+    limiter = RateLimiter(rate=2)
+    limiter.acquire(url)  # sleeps until a request to url's host is allowed
+    limiter.feedback(url, status=429, elapsed=0.3)
+    """
+    rate: float = attr.ib(default=2.0)
+    min_rate: float = attr.ib(default=0.1)
+    max_rate: float = attr.ib(default=10.0)
+    burst: float = attr.ib(default=5.0)
+    backoff: float = attr.ib(default=0.5)
+    recovery: float = attr.ib(default=0.1)
+    slow_seconds: float = attr.ib(default=5.0)
+    decrease_interval: float = attr.ib(default=1.0)
+    clock: Callable[[], float] = attr.ib(default=time.monotonic, repr=False)
+    buckets: Dict[str, TokenBucket] = attr.ib(factory=dict, repr=False)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False)
+
+    def _bucket(self, host: str, now: float) -> TokenBucket:
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst, self.burst, now)
+        return self.buckets[host]
+
+    def host_rate(self, url: str) -> float:
+        with self._lock:
+            return self._bucket(urlsplit(url).netloc, self.clock()).rate
+
+    def reserve(self, url: str) -> float:
+        """reserve a request to url's host and return the seconds to wait for it"""
+        with self._lock:
+            now = self.clock()
+            return self._bucket(urlsplit(url).netloc, now).reserve(now)
+
+    def acquire(self, url: str):
+        delay = self.reserve(url)
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self, url: str):
+        delay = self.reserve(url)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def feedback(
+            self, url: str, status: Optional[int], elapsed: float,
+            retry_after: Optional[float] = None,
+    ):
+        """
+        feedback adapts the host's rate to a response,
+        `status` is None when the request failed to get one.
+        """
+        with self._lock:
+            now = self.clock()
+            bucket = self._bucket(urlsplit(url).netloc, now)
+            if not failed(status) and elapsed <= self.slow_seconds:
+                bucket.rate = min(self.max_rate, bucket.rate + self.recovery)
+                return
+            bucket.refill(now)
+            if now - bucket.decreased >= self.decrease_interval:
+                bucket.rate = max(self.min_rate, bucket.rate * self.backoff)
+                bucket.decreased = now
+            hold = retry_after * bucket.rate if retry_after else 0.0
+            bucket.tokens = min(bucket.tokens, -hold, 0.0)
+
+
+def retry_after(headers) -> Optional[float]:
+    """the Retry-After header in seconds, when given as seconds"""
+    value = headers.get("Retry-After")
+    if value and value.strip().isdigit():
+        return float(value)
+    return None